@@ -0,0 +1,48 @@
+"""
+Authentication backend that caches the logged-in user.
+
+AuthenticationMiddleware loads the user on every request; with this backend
+the row comes from the cache, so an authenticated JSON call costs no auth
+queries at all. The cached copy is dropped whenever the user is saved or
+deleted (profile edits, password changes, last_login updates), see
+accounts.signals. A per-process cache (locmem, dummy) cannot carry that
+eviction to the other workers, so with one the backend reads the database
+like ModelBackend.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def _cache():
+    """The user cache, or None when it is not shared between processes"""
+    cache = caches[settings.USER_CACHE_ALIAS]
+    return None if isinstance(cache, LOCAL_CACHES) else cache
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_user(user_id):
+    cache = _cache()
+    if cache is not None:
+        cache.delete(user_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        cache = _cache()
+        if cache is None:
+            return super().get_user(user_id)
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, timeout=settings.USER_CACHE_TIMEOUT)
+        return user
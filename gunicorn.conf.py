@@ -0,0 +1,26 @@
+"""
+Gunicorn settings, read automatically from the working directory.
+
+The application is loaded once in the master (``preload_app``) and the
+workers are forked from it, so a new or restarted worker starts serving
+without importing Django, the project and the URLconf again. Objects
+created during the load are moved out of the garbage collector's view
+before forking, keeping their memory pages shared between workers.
+"""
+import gc
+
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+errorlog = '-'
+
+
+def pre_fork(server, worker):
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Connections must never be shared across processes; none should be open
+    # after loading, but close any a setting or import opened
+    from django.db import connections
+    
+    connections.close_all()
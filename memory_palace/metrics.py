@@ -0,0 +1,239 @@
+"""
+Per-view request metrics in the Prometheus text format.
+
+MetricsMiddleware records, for every request, latency, SQL query count and
+time, template render time and response size, labelled by URL name. Each
+worker process keeps its samples in memory and periodically writes them to
+its own file in ``METRICS_DIR``; the ``/metrics`` view sums every worker's
+file, so the numbers cover all gunicorn workers. Only counters are used
+(histograms are bucket counters), which makes summing across processes exact.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import Template as DjangoTemplate
+from django.utils.crypto import constant_time_compare
+
+slow_logger = logging.getLogger('memory_palace.slow_requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760)
+
+# name -> (type, help)
+METRICS = {
+    'mp_http_requests_total': ('counter', 'Requests by view, method and status'),
+    'mp_http_request_duration_seconds': ('histogram', 'Request latency by view'),
+    'mp_http_db_queries': ('histogram', 'SQL queries per request by view'),
+    'mp_http_db_query_seconds_total': ('counter', 'Time spent in SQL by view'),
+    'mp_http_template_render_seconds_total': ('counter', 'Time spent rendering templates by view'),
+    'mp_http_response_size_bytes': ('histogram', 'Response body size by view'),
+}
+
+_lock = threading.Lock()
+_samples = {}
+_last_flush = 0.0
+
+# Per-request accumulators, set by the middleware while a request is active
+_request_stats = ContextVar('request_stats', default=None)
+
+
+def _key(name, labels):
+    return name + '{' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
+
+
+def _inc(name, labels, value=1.0):
+    key = _key(name, labels)
+    _samples[key] = _samples.get(key, 0.0) + value
+
+
+def _observe(name, labels, value, buckets):
+    for bound in buckets:
+        if value <= bound:
+            _inc(f'{name}_bucket', {**labels, 'le': str(bound)})
+    _inc(f'{name}_bucket', {**labels, 'le': '+Inf'})
+    _inc(f'{name}_sum', labels, value)
+    _inc(f'{name}_count', labels)
+
+
+def flush():
+    """Write this process's samples to its own file, atomically"""
+    global _last_flush
+    directory = settings.METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    with _lock:
+        data = json.dumps(_samples)
+        _last_flush = time.monotonic()
+    path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def collect():
+    """Sum the samples of every worker process"""
+    flush()
+    totals = {}
+    directory = settings.METRICS_DIR
+    for filename in os.listdir(directory):
+        if not (filename.startswith('metrics-') and filename.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                samples = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for key, value in samples.items():
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+_LE = re.compile(r'le="([^"]+)",?')
+
+
+def _sort_key(key):
+    # Group histogram buckets per label set, in ascending bucket order
+    match = _LE.search(key)
+    return (key.split('{')[0], _LE.sub('', key), float(match.group(1)) if match else 0)
+
+
+def render(samples):
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        prefix = name + ('_' if metric_type == 'histogram' else '{')
+        for key in sorted(samples, key=_sort_key):
+            if key.startswith(prefix):
+                value = samples[key]
+                lines.append(f'{key} {int(value) if value.is_integer() else value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _timed_template_render(render_method):
+    def render(self, *args, **kwargs):
+        stats = _request_stats.get()
+        if stats is None:
+            return render_method(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return render_method(self, *args, **kwargs)
+        finally:
+            # Nested {% include %}s are rendered by the engine directly, so
+            # only top-level templates are timed and nothing is counted twice
+            stats['template_seconds'] += time.perf_counter() - started
+    render.__wrapped__ = render_method
+    return render
+
+
+if not hasattr(DjangoTemplate.render, '__wrapped__'):
+    DjangoTemplate.render = _timed_template_render(DjangoTemplate.render)
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats['queries'].append((time.perf_counter() - started, sql))
+
+
+def _install_query_recorder(sender, connection, **kwargs):
+    # Installed once per connection rather than per request: async views run
+    # their queries in worker threads, each with its own connection, and the
+    # request's stats reach them through the context variable
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        connection_created.connect(_install_query_recorder, dispatch_uid='metrics_query_recorder')
+    
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = {'queries': [], 'template_seconds': 0.0}
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, time.perf_counter() - started, stats)
+    
+    async def __acall__(self, request):
+        stats = {'queries': [], 'template_seconds': 0.0}
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, time.perf_counter() - started, stats)
+    
+    def finish(self, request, response, duration, stats):
+        match = request.resolver_match
+        view = (match.view_name if match else None) or 'unresolved'
+        self.record(request, response, view, duration, stats)
+        
+        threshold = settings.METRICS_SLOW_REQUEST_MS
+        if threshold and duration * 1000 >= threshold:
+            self.log_slow_request(request, view, duration, stats)
+        return response
+    
+    def record(self, request, response, view, duration, stats):
+        labels = {'view': view}
+        size = len(response.content) if not response.streaming else 0
+        with _lock:
+            _inc('mp_http_requests_total', {**labels, 'method': request.method, 'status': str(response.status_code)})
+            _observe('mp_http_request_duration_seconds', labels, duration, LATENCY_BUCKETS)
+            _observe('mp_http_db_queries', labels, len(stats['queries']), QUERY_COUNT_BUCKETS)
+            _inc('mp_http_db_query_seconds_total', labels, sum(seconds for seconds, _ in stats['queries']))
+            _inc('mp_http_template_render_seconds_total', labels, stats['template_seconds'])
+            _observe('mp_http_response_size_bytes', labels, size, SIZE_BUCKETS)
+        
+        if time.monotonic() - _last_flush >= settings.METRICS_FLUSH_SECONDS:
+            flush()
+    
+    def log_slow_request(self, request, view, duration, stats):
+        queries = sorted(stats['queries'], reverse=True)[:10]
+        slow_logger.warning(
+            'Slow request %s %s (%s): %.0fms, %d queries in %.0fms, templates %.0fms\n%s',
+            request.method, request.path, view, duration * 1000, len(stats['queries']),
+            sum(seconds for seconds, _ in stats['queries']) * 1000, stats['template_seconds'] * 1000,
+            '\n'.join(f'  {seconds * 1000:.1f}ms {sql}' for seconds, sql in queries),
+        )
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; needs ``Authorization: Bearer <METRICS_TOKEN>`` or a staff login"""
+    token = settings.METRICS_TOKEN
+    header = request.headers.get('Authorization', '')
+    authorized = (
+        (token and constant_time_compare(header, f'Bearer {token}'))
+        or (request.user.is_authenticated and request.user.is_staff)
+    )
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
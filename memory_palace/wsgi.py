@@ -5,7 +5,13 @@ WSGI config for memory_palace project.
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'memory_palace.settings')
 
-application = get_wsgi_application()
\ No newline at end of file
+application = get_wsgi_application()
+
+# Import the URLconf, and with it every view and form, now instead of on the
+# first request: a gunicorn master started with --preload then does this once
+# for all the workers it forks
+get_resolver().url_patterns
\ No newline at end of file
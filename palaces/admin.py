@@ -1,13 +1,37 @@
-from django.contrib import admin
-from .models import Palace, Room, MemoryItem, StudySession
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Palace, Room, MemoryItem, StudySession, ReviewEvent, ImageJob, RouteJob, Tombstone, MonthlyStudySummary
+from .pagination import EstimatedCountPaginator
+from .scheduling import DEFAULT_EASE
+from .search import get_backend
+from .signals import schedule_palace_refresh
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables too big to COUNT(*) on every page"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class PalaceActionForm(ActionForm):
+    new_owner = forms.CharField(required=False, label='New owner (username)')
 
 
 @admin.register(Palace)
-class PalaceAdmin(admin.ModelAdmin):
+class PalaceAdmin(LargeTableAdmin):
     list_display = ['name', 'owner', 'palace_type', 'is_public', 'created_at']
     list_filter = ['palace_type', 'is_public', 'created_at']
+    list_select_related = ['owner']
     search_fields = ['name', 'owner__username', 'description']
+    autocomplete_fields = ['owner']
     readonly_fields = ['id', 'created_at', 'updated_at']
+    action_form = PalaceActionForm
+    actions = ['make_public', 'make_private', 'reassign_owner']
     
     fieldsets = (
         (None, {
@@ -18,13 +42,53 @@ class PalaceAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    def _set_public(self, request, queryset, is_public):
+        with transaction.atomic():
+            palaces = dict(queryset.values_list('pk', 'owner_id'))
+            updated = Palace.objects.filter(pk__in=palaces).update(is_public=is_public, updated_at=timezone.now())
+            schedule_palace_refresh(palace_ids=palaces, owner_ids=palaces.values())
+        self.message_user(request, f'{updated} palace(s) updated.')
+    
+    @admin.action(description='Make selected palaces public')
+    def make_public(self, request, queryset):
+        self._set_public(request, queryset, True)
+    
+    @admin.action(description='Make selected palaces private')
+    def make_private(self, request, queryset):
+        self._set_public(request, queryset, False)
+    
+    @admin.action(description='Reassign selected palaces to the user named below')
+    def reassign_owner(self, request, queryset):
+        username = request.POST.get('new_owner', '').strip()
+        owner = User.objects.filter(username=username).first()
+        if owner is None:
+            self.message_user(request, f'No user named "{username}".', level=messages.ERROR)
+            return
+        with transaction.atomic():
+            palaces = dict(queryset.values_list('pk', 'owner_id'))
+            now = timezone.now()
+            updated = Palace.objects.filter(pk__in=palaces).update(owner=owner, updated_at=now)
+            get_backend().update_owner(palaces, owner.pk)
+            # Synced clients: the old owners drop the palaces, the new owner pulls their rooms and items
+            Tombstone.objects.bulk_create([
+                Tombstone(owner_id=old_owner, kind=Tombstone.PALACE, object_id=pk, deleted_at=now)
+                for pk, old_owner in palaces.items() if old_owner != owner.pk
+            ])
+            Room.objects.filter(palace__in=palaces).update(updated_at=now)
+            MemoryItem.objects.filter(room__palace__in=palaces).update(updated_at=now)
+            # Both the old and the new owners' palace lists change
+            schedule_palace_refresh(palace_ids=palaces, owner_ids={*palaces.values(), owner.pk})
+        self.message_user(request, f'{updated} palace(s) reassigned to {owner.username}.')
 
 
 @admin.register(Room)
-class RoomAdmin(admin.ModelAdmin):
+class RoomAdmin(LargeTableAdmin):
     list_display = ['name', 'palace', 'order', 'x_coordinate', 'y_coordinate']
-    list_filter = ['palace__palace_type', 'palace__owner']
-    search_fields = ['name', 'palace__name', 'description']
+    list_filter = ['palace__palace_type']
+    list_select_related = ['palace__owner']
+    search_fields = ['name', 'palace__name', 'palace__owner__username', 'description']
+    autocomplete_fields = ['palace']
     readonly_fields = ['id']
     
     fieldsets = (
@@ -42,11 +106,15 @@ class RoomAdmin(admin.ModelAdmin):
 
 
 @admin.register(MemoryItem)
-class MemoryItemAdmin(admin.ModelAdmin):
-    list_display = ['content_preview', 'room', 'item_type', 'position_in_room', 'is_mastered', 'last_reviewed']
-    list_filter = ['item_type', 'is_mastered', 'room__palace__palace_type', 'created_at']
+class MemoryItemAdmin(LargeTableAdmin):
+    list_display = ['content_preview', 'room', 'item_type', 'position_in_room', 'is_mastered', 'last_reviewed', 'next_due']
+    list_filter = ['item_type', 'is_mastered', 'room__palace__palace_type']
+    list_select_related = ['room__palace']
     search_fields = ['content', 'mnemonic_hint', 'room__name', 'room__palace__name']
+    autocomplete_fields = ['room']
+    date_hierarchy = 'created_at'
     readonly_fields = ['id', 'created_at', 'last_reviewed']
+    actions = ['reset_mastery']
     
     def content_preview(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
@@ -57,20 +125,30 @@ class MemoryItemAdmin(admin.ModelAdmin):
             'fields': ('room', 'content', 'item_type', 'mnemonic_hint', 'position_in_room', 'image')
         }),
         ('Progress', {
-            'fields': ('is_mastered',)
+            'fields': ('is_mastered', 'ease_factor', 'interval_days', 'repetitions', 'next_due')
         }),
         ('Metadata', {
             'fields': ('id', 'created_at', 'last_reviewed'),
             'classes': ('collapse',)
         }),
     )
+    
+    @admin.action(description='Reset mastery and review schedule')
+    def reset_mastery(self, request, queryset):
+        updated = queryset.update(
+            is_mastered=False, ease_factor=DEFAULT_EASE, interval_days=0, repetitions=0, next_due=timezone.now()
+        )
+        self.message_user(request, f'{updated} item(s) reset.')
 
 
 @admin.register(StudySession)
-class StudySessionAdmin(admin.ModelAdmin):
+class StudySessionAdmin(LargeTableAdmin):
     list_display = ['palace', 'user', 'started_at', 'completed_at', 'items_reviewed', 'accuracy_score']
-    list_filter = ['completed_at', 'palace__palace_type', 'started_at']
+    list_filter = ['completed_at', 'palace__palace_type']
+    list_select_related = ['palace__owner', 'user']
     search_fields = ['palace__name', 'user__username']
+    autocomplete_fields = ['user', 'palace']
+    date_hierarchy = 'started_at'
     readonly_fields = ['id', 'started_at', 'duration']
     
     def duration(self, obj):
@@ -88,4 +166,47 @@ class StudySessionAdmin(admin.ModelAdmin):
             'fields': ('id', 'duration'),
             'classes': ('collapse',)
         }),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(MonthlyStudySummary)
+class MonthlyStudySummaryAdmin(LargeTableAdmin):
+    list_display = ['month', 'user', 'palace', 'sessions', 'items_reviewed', 'items_mastered', 'seconds_studied']
+    date_hierarchy = 'month'
+    search_fields = ['user__username', 'palace__name']
+    list_select_related = ['user', 'palace']
+    readonly_fields = ['user', 'palace', 'month', 'sessions', 'items_reviewed', 'items_mastered', 'seconds_studied']
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ReviewEvent)
+class ReviewEventAdmin(LargeTableAdmin):
+    list_display = ['item', 'user', 'grade', 'response_time_ms', 'reviewed_at']
+    list_filter = ['grade']
+    date_hierarchy = 'reviewed_at'
+    search_fields = ['user__username']
+    list_select_related = ['item__room__palace', 'user']
+    readonly_fields = ['id', 'user', 'item', 'session', 'grade', 'response_time_ms', 'reviewed_at']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ['model_label', 'object_id', 'status', 'attempts', 'created_at', 'updated_at']
+    list_filter = ['status', 'model_label']
+    readonly_fields = ['model_label', 'object_id', 'attempts', 'error', 'created_at', 'updated_at']
+
+
+@admin.register(RouteJob)
+class RouteJobAdmin(admin.ModelAdmin):
+    list_display = ['palace', 'status', 'attempts', 'created_at', 'updated_at']
+    list_filter = ['status']
+    list_select_related = ['palace__owner']
+    readonly_fields = ['palace', 'attempts', 'error', 'created_at', 'updated_at']
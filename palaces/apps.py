@@ -4,4 +4,11 @@ from django.apps import AppConfig
 class PalacesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'palaces'
-    verbose_name = 'Memory Palaces'
\ No newline at end of file
+    verbose_name = 'Memory Palaces'
+    
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from memory_palace.database import configure_sqlite
+        from . import signals  # noqa: F401
+        
+        connection_created.connect(configure_sqlite, dispatch_uid='configure_sqlite')
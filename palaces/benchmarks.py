@@ -0,0 +1,291 @@
+"""
+View benchmarks: seed large synthetic data sets and measure query counts,
+latency and memory of every palace URL against budgets and baselines.
+
+Used by the ``seed_benchmark_data`` and ``run_benchmarks`` commands.
+"""
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, reset_queries, transaction
+from django.template import TemplateDoesNotExist
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import cache, study, sync
+from .models import Palace, Room, MemoryItem
+
+USER_PREFIX = 'bench_'
+WORDS = (
+    'apple river castle lantern violin tiger marble comet harbor meadow crystal falcon '
+    'velvet thunder orchard pepper silver garden mirror candle anchor dragon glacier '
+    'compass feather jungle pyramid saddle trumpet volcano whistle'
+).split()
+
+# Default p95 latency threshold (ms) for scenarios that don't set their own
+DEFAULT_P95_MS = 250
+
+
+def _sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+
+def seed(users=10, palaces=5, rooms=20, items=30, seed_value=0, stdout=None):
+    """Create ``users`` bench users, each with palaces -> rooms -> items, via bulk_create
+
+    Each user's tree is inserted in its own transaction so memory stays
+    bounded at one user's worth of objects.
+    """
+    rng = random.Random(seed_value)
+    now = timezone.now()
+    password = make_password('bench')
+    start = User.objects.filter(username__startswith=USER_PREFIX).count()
+    
+    for number in range(start, start + users):
+        with transaction.atomic():
+            user = User.objects.create(username=f'{USER_PREFIX}{number}', password=password)
+            palace_objs = Palace.objects.bulk_create([
+                Palace(
+                    owner=user, name=f'{_sentence(rng, 2).title()} Palace',
+                    description=_sentence(rng, 12), palace_type=rng.choice(Palace.PALACE_TYPES)[0],
+                    is_public=rng.random() < 0.2,
+                )
+                for _ in range(palaces)
+            ])
+            room_objs = Room.objects.bulk_create([
+                Room(
+                    palace=palace, name=f'{_sentence(rng, 1).title()} Room {order}', order=order,
+                    description=_sentence(rng, 8),
+                    x_coordinate=rng.uniform(0, 100), y_coordinate=rng.uniform(0, 100),
+                )
+                for palace in palace_objs
+                for order in range(1, rooms + 1)
+            ])
+            for offset in range(0, len(room_objs), 50):
+                MemoryItem.objects.bulk_create([
+                    MemoryItem(
+                        room=room, content=_sentence(rng, 6), mnemonic_hint=_sentence(rng, 8),
+                        position_in_room=position, is_mastered=rng.random() < 0.3,
+                        next_due=now + timedelta(days=rng.uniform(-30, 30)),
+                        repetitions=rng.randint(0, 6), interval_days=rng.randint(0, 40),
+                    )
+                    for room in room_objs[offset:offset + 50]
+                    for position in range(1, items + 1)
+                ], batch_size=2000)
+        if stdout:
+            stdout.write(f'Seeded {user.username}')
+    return users
+
+
+def clear():
+    """Delete every bench user; cascades to their palaces"""
+    return User.objects.filter(username__startswith=USER_PREFIX).delete()[0]
+
+
+def allowed_host():
+    """A host name the application accepts, for requests made outside a server"""
+    return next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+
+
+def _fixture():
+    """Ids of the busiest bench user's first palace, room and items"""
+    palace = (
+        Palace.objects.filter(owner__username__startswith=USER_PREFIX)
+        .select_related('owner').order_by('-item_count').first()
+    )
+    if palace is None:
+        raise LookupError('No benchmark data; run seed_benchmark_data first')
+    room = palace.rooms.first()
+    items = list(MemoryItem.objects.filter(room__palace=palace)[:20])
+    return palace, room, items
+
+
+def _sync_round_trip(palace):
+    """A push of ``palace`` based on the ``updated_at`` a pull returned, and a check that it applies
+    
+    The pulled page goes through the same JSON encoding as the response,
+    so a base that lost precision on the way shows up as a conflict.
+    """
+    page = json.loads(json.dumps(sync.pull(palace.owner, limit=sync.MAX_PAGE_SIZE), cls=DjangoJSONEncoder))
+    pulled = next((row for row in page['palaces'] if row['id'] == str(palace.pk)), None)
+    change = {'type': 'palace', 'id': str(palace.pk), 'fields': {'name': palace.name}}
+    if pulled is not None:
+        change['base_updated_at'] = pulled['updated_at']
+    
+    def expect(response):
+        if pulled is None:
+            # Changed too recently to be pulled yet; nothing to compare
+            return None
+        status = response.json()['results'][0]['status']
+        return None if status == 'applied' else f'pulled updated_at pushed back got {status}'
+    
+    return json.dumps({'changes': [change]}), expect
+
+
+def scenarios(palace, room, items):
+    """(url name, method, url, payload, query budget[, check]) for every palace URL
+    
+    A string payload is sent as JSON, a dict as form data. ``check`` is
+    called with the first response and returns an error message or None.
+    """
+    session_pk = study.start(palace.owner, palace)
+    word = items[0].content.split()[0] if items else 'palace'
+    reviews = json.dumps({'reviews': [{'item': str(item.pk), 'grade': 4} for item in items]})
+    room_order = json.dumps({'order': [str(pk) for pk in palace.rooms.values_list('pk', flat=True)]})
+    item_order = json.dumps({'order': [str(pk) for pk in room.memory_items.values_list('pk', flat=True)]})
+    sync_push, sync_expect = _sync_round_trip(palace)
+    return [
+        ('palace_list', 'get', reverse('palace_list'), None, 4),
+        ('palace_create', 'get', reverse('palace_create'), None, 3),
+        ('palace_search', 'get', reverse('palace_search') + f'?q={word}', None, 3),
+        ('palace_gallery', 'get', reverse('palace_gallery'), None, 3),
+        # Bench users are not staff, so this measures the permission check and redirect
+        ('cache_stats', 'get', reverse('cache_stats'), None, 2),
+        ('palace_detail', 'get', reverse('palace_detail', args=[palace.pk]), None, 4),
+        ('palace_edit', 'get', reverse('palace_edit', args=[palace.pk]), None, 3),
+        ('palace_delete', 'get', reverse('palace_delete', args=[palace.pk]), None, 3),
+        ('palace_import', 'get', reverse('palace_import', args=[palace.pk]), None, 3),
+        ('palace_clone', 'post', reverse('palace_clone', args=[palace.pk]), {'include_items': '1'}, 19),
+        ('palace_export', 'get', reverse('palace_export', args=[palace.pk]), None, 5),
+        ('study_bundle', 'get', reverse('study_bundle', args=[palace.pk]), None, 5),
+        ('room_create', 'get', reverse('room_create', args=[palace.pk]), None, 3),
+        ('room_detail', 'get', reverse('room_detail', args=[palace.pk, room.pk]), None, 5),
+        ('reorder_rooms', 'post', reverse('reorder_rooms', args=[palace.pk]), room_order, 18),
+        ('reorder_items', 'post', reverse('reorder_items', args=[palace.pk, room.pk]), item_order, 13),
+        ('memory_item_create', 'get', reverse('memory_item_create', args=[palace.pk, room.pk]), None, 4),
+        ('toggle_mastery', 'post', reverse('toggle_mastery', args=[items[0].pk]), None, 6),
+        ('start_study_session', 'get', reverse('start_study_session', args=[palace.pk]), None, 3),
+        ('study_session', 'get', reverse('study_session', args=[session_pk]), None, 5),
+        ('submit_reviews', 'post', reverse('submit_reviews', args=[session_pk]), reviews, 4),
+        ('progress_stats', 'get', reverse('progress_stats'), None, 3),
+        ('palace_progress_stats', 'get', reverse('palace_progress_stats', args=[palace.pk]), None, 4),
+        ('sync_changes', 'get', reverse('sync_changes'), None, 5),
+        ('sync_push', 'post', reverse('sync_changes'), sync_push, 10, sync_expect),
+    ]
+
+
+def run(iterations=20, only=None, cold=False):
+    """Drive every scenario through the test client and collect measurements
+
+    The query count is taken from the first request, made with an empty
+    cache, so budgets hold for the worst case. With ``cold`` the cache is
+    also cleared before every timed request.
+    """
+    palace, room, items = _fixture()
+    client = Client(raise_request_exception=False, HTTP_HOST=allowed_host())
+    client.force_login(palace.owner)
+    existing = set(Palace.objects.filter(owner=palace.owner).values_list('pk', flat=True))
+    results = {}
+    
+    for name, method, url, payload, budget, *expect in scenarios(palace, room, items):
+        if only and name not in only:
+            continue
+        
+        def request():
+            if isinstance(payload, str):
+                kwargs = {'data': payload, 'content_type': 'application/json'}
+            else:
+                kwargs = {'data': payload} if payload else {}
+            response = getattr(client, method)(url, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            return response
+        
+        cache.get_cache().clear()
+        # CaptureQueriesContext diffs a bounded log, so start from an empty one
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        query_count = len(queries)
+        error = expect[0](response) if expect and 200 <= response.status_code < 300 else None
+        exc_info = getattr(response, 'exc_info', None)
+        if exc_info and isinstance(exc_info[1], TemplateDoesNotExist):
+            # Nothing to measure until the view's template exists
+            results[name] = {'status': response.status_code, 'skipped': f'missing template {exc_info[1]}'}
+            continue
+        
+        timings = []
+        for _ in range(iterations):
+            if cold:
+                cache.get_cache().clear()
+            started = time.perf_counter()
+            request()
+            timings.append((time.perf_counter() - started) * 1000)
+        
+        # Traced separately: tracemalloc slows Python down several times over
+        if cold:
+            cache.get_cache().clear()
+        tracemalloc.start()
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        
+        timings.sort()
+        results[name] = {
+            'status': response.status_code,
+            'queries': query_count,
+            'query_budget': budget,
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(timings[max(0, int(len(timings) * 0.95) - 1)], 2),
+            'peak_kb': round(peak / 1024, 1),
+        }
+        if error:
+            results[name]['error'] = error
+    
+    # Palaces made by the palace_clone scenario
+    Palace.objects.filter(owner=palace.owner).exclude(pk__in=existing).delete()
+    return {
+        'meta': {
+            'iterations': iterations,
+            'cold': cold,
+            'vendor': connection.vendor,
+            'palace_items': palace.item_count,
+            'palace_rooms': palace.room_count,
+        },
+        'results': results,
+    }
+
+
+def check(report, baseline=None, tolerance=0.5, p95_ms=DEFAULT_P95_MS):
+    """Return a list of human-readable failures for ``report``
+
+    A scenario fails when it does not answer 2xx/3xx, its check reports an
+    error, it runs more queries than its budget or its baseline, its p95
+    exceeds ``p95_ms``, or its p95 regressed by more than ``tolerance`` (a
+    fraction, plus a 5ms noise floor) over the baseline. Skipped scenarios
+    are not checked.
+    """
+    failures = []
+    baseline = (baseline or {}).get('results', {})
+    for name, result in report['results'].items():
+        if result.get('skipped'):
+            continue
+        if not 200 <= result['status'] < 400:
+            failures.append(f"{name}: HTTP {result['status']}")
+            continue
+        if result.get('error'):
+            failures.append(f"{name}: {result['error']}")
+        if result['queries'] > result['query_budget']:
+            failures.append(f"{name}: {result['queries']} queries (budget {result['query_budget']})")
+        if result['p95_ms'] > p95_ms:
+            failures.append(f"{name}: p95 {result['p95_ms']}ms (threshold {p95_ms}ms)")
+        
+        previous = baseline.get(name)
+        if previous is None or previous.get('skipped'):
+            continue
+        if result['queries'] > previous['queries']:
+            failures.append(f"{name}: {result['queries']} queries (baseline {previous['queries']})")
+        limit = previous['p95_ms'] * (1 + tolerance) + 5
+        if result['p95_ms'] > limit:
+            failures.append(f"{name}: p95 {result['p95_ms']}ms (baseline {previous['p95_ms']}ms)")
+    return failures
@@ -0,0 +1,89 @@
+"""
+Offline study bundles: a whole palace in one compact payload.
+
+Rooms and items are encoded as a field list plus rows of values rather than
+one object per row. Bundles are cached gzip-compressed under the palace's
+content version (see palaces.cache), so they are rebuilt only after a
+palace, room or item changes, and the same version doubles as the ETag.
+"""
+import gzip
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+from . import cache, routing
+from .images import rendition_url
+from .models import Room, MemoryItem
+
+BUNDLE_VERSION = 1
+ROOM_FIELDS = ['id', 'name', 'description', 'x', 'y', 'image']
+ITEM_FIELDS = ['id', 'room', 'content', 'item_type', 'hint', 'position', 'image']
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'msgpack': 'application/msgpack',
+}
+
+
+def available_formats():
+    return [fmt for fmt in CONTENT_TYPES if fmt != 'msgpack' or msgpack is not None]
+
+
+def build_bundle(palace):
+    """The bundle as plain data; two queries (rooms, items)"""
+    rooms = routing.rooms_in_route(palace, Room.objects.filter(palace=palace).only(
+        'id', 'name', 'description', 'x_coordinate', 'y_coordinate', 'image', 'image_renditions',
+    ))
+    items = (
+        MemoryItem.objects.filter(room__palace=palace)
+        .order_by('room_id', 'position_in_room')
+        .values_list('id', 'room_id', 'content', 'item_type', 'mnemonic_hint', 'position_in_room',
+                     'image', 'image_renditions')
+    )
+    return {
+        'version': BUNDLE_VERSION,
+        'palace': {
+            'id': str(palace.pk),
+            'name': palace.name,
+            'description': palace.description,
+            'palace_type': palace.palace_type,
+            'image': rendition_url(palace.image.name if palace.image else '', palace.image_renditions, 'card'),
+            'route_length': palace.walk_route.get('length'),
+        },
+        'rooms': {
+            'fields': ROOM_FIELDS,
+            'rows': [
+                [str(room.pk), room.name, room.description, room.x_coordinate, room.y_coordinate,
+                 rendition_url(room.image.name if room.image else '', room.image_renditions, 'card')]
+                for room in rooms
+            ],
+        },
+        'items': {
+            'fields': ITEM_FIELDS,
+            'rows': [
+                [str(pk), str(room_id), content, item_type, hint, position,
+                 rendition_url(image, renditions, 'card')]
+                for pk, room_id, content, item_type, hint, position, image, renditions in items.iterator()
+            ],
+        },
+    }
+
+
+def encode(bundle, fmt):
+    if fmt == 'msgpack':
+        return msgpack.packb(bundle, use_bin_type=True)
+    return json.dumps(bundle, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+
+
+def get_bundle(palace, version, fmt):
+    """gzip-compressed bundle bytes for ``palace`` at content ``version``"""
+    return cache.cached_call(
+        'study_bundle', f'{palace.pk}:{version}:{fmt}',
+        lambda: gzip.compress(encode(build_bundle(palace), fmt), compresslevel=6),
+        timeout=settings.PALACE_CACHE_TIMEOUT,
+    )
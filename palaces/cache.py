@@ -0,0 +1,117 @@
+"""
+Versioned caching for palace pages.
+
+Every palace and every user's palace list has a version number stored in
+the cache. Cache keys for rendered pages embed those versions, so any
+write under a palace (see palaces.signals) makes the old entries
+unreachable instead of having to find and delete them.
+"""
+import time
+from collections import Counter
+
+from django.contrib import messages
+from django.core.cache import caches
+from django.conf import settings
+from django.http import HttpResponse
+
+PALACE = 'palace'
+USER = 'user'
+
+# Per-process hit/miss counters keyed by cache name, e.g. 'palace_detail:hit'
+stats = Counter()
+
+
+def get_cache():
+    return caches[getattr(settings, 'PALACE_CACHE_ALIAS', 'default')]
+
+
+def _version_key(scope, pk):
+    return f'v:{scope}:{pk}'
+
+
+def get_versions(*scopes):
+    """Current versions for (scope, pk) pairs, creating missing ones, in one round-trip"""
+    cache = get_cache()
+    keys = [_version_key(scope, pk) for scope, pk in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        # A version that was evicted restarts from the clock, never from a
+        # number an older entry may still be stored under
+        for key, value in missing.items():
+            cache.add(key, value, timeout=None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(key, missing.get(key)) for key in keys]
+
+
+def bump(scope, pk):
+    cache = get_cache()
+    key = _version_key(scope, pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump_palaces(palace_ids=(), owner_ids=()):
+    for pk in set(palace_ids):
+        bump(PALACE, pk)
+    for pk in set(owner_ids):
+        bump(USER, pk)
+
+
+def cached_call(name, key, func, timeout=None):
+    """Return ``func()`` through the cache under ``name:key``, counting hits and misses"""
+    cache = get_cache()
+    full_key = f'{name}:{key}'
+    value = cache.get(full_key)
+    if value is not None:
+        stats[f'{name}:hit'] += 1
+        return value
+    stats[f'{name}:miss'] += 1
+    value = func()
+    cache.set(full_key, value, timeout=timeout or settings.PALACE_CACHE_TIMEOUT)
+    return value
+
+
+class VersionedPageCacheMixin:
+    """Serve a view's rendered GET response from the cache
+
+    Subclasses return the (scope, pk) pairs the page depends on from
+    ``get_cache_scopes()``; the key also includes the user, the path and
+    the query string. Responses are not cached while flash messages are
+    pending, since those are rendered into the page.
+    """
+    cache_name = None
+    
+    def get_cache_scopes(self):
+        raise NotImplementedError
+    
+    def get_page_cache_key(self):
+        versions = get_versions(*self.get_cache_scopes())
+        version = '.'.join(str(version) for version in versions)
+        return f'page:{self.cache_name}:{self.request.user.pk}:{version}:{self.request.get_full_path()}'
+    
+    def get(self, request, *args, **kwargs):
+        if len(messages.get_messages(request)):
+            return super().get(request, *args, **kwargs)
+        
+        cache = get_cache()
+        key = self.get_page_cache_key()
+        content = cache.get(key)
+        if content is not None:
+            stats[f'{self.cache_name}:hit'] += 1
+            return HttpResponse(content)
+        
+        stats[f'{self.cache_name}:miss'] += 1
+        response = super().get(request, *args, **kwargs)
+        
+        def store(response):
+            if response.status_code == 200:
+                cache.set(key, response.content, timeout=settings.PALACE_CACHE_TIMEOUT)
+        
+        if hasattr(response, 'add_post_render_callback'):
+            response.add_post_render_callback(store)
+        else:
+            store(response)
+        return response
@@ -0,0 +1,95 @@
+"""
+Deep copies of palaces.
+
+A clone costs a fixed number of queries however large the source is: one
+INSERT for the palace, one bulk INSERT for its rooms and a single
+INSERT ... SELECT that copies every item inside the database, so no item
+rows pass through Python. Image files are shared with the source (only the
+storage name is copied, along with its renditions, so the image worker has
+nothing to do).
+"""
+import uuid
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Palace, Room, MemoryItem
+from .search import get_backend
+from .signals import schedule_palace_refresh
+
+ROOM_FIELDS = ['id', 'name', 'description', 'order', 'image', 'image_renditions', 'x_coordinate', 'y_coordinate']
+# Copied from the source item; every other column takes the value a new item would get
+ITEM_FIELDS = ['content', 'item_type', 'mnemonic_hint', 'position_in_room', 'image', 'image_renditions']
+
+# SQL producing a fresh UUID in the format UUIDField stores on each backend
+UUID_SQL = {
+    'sqlite': 'lower(hex(randomblob(16)))',
+    'postgresql': 'gen_random_uuid()',
+    'mysql': "REPLACE(UUID(), '-', '')",
+}
+
+
+def _copy_items(source, palace):
+    """Copy all items of ``source`` into the rooms of ``palace`` with the same ``order``"""
+    qn = connection.ops.quote_name
+    now = timezone.now()
+    fresh = MemoryItem(created_at=now, updated_at=now)
+    columns, values, params = [], [], []
+    for field in MemoryItem._meta.concrete_fields:
+        columns.append(qn(field.column))
+        if field.primary_key:
+            values.append(UUID_SQL[connection.vendor])
+        elif field.name == 'room':
+            values.append(f'new_room.{qn("id")}')
+        elif field.name == 'palace':
+            values.append(f'new_room.{qn("palace_id")}')
+        elif field.name in ITEM_FIELDS:
+            values.append(f'item.{qn(field.column)}')
+        else:
+            values.append('%s')
+            params.append(field.get_db_prep_save(getattr(fresh, field.attname), connection))
+    
+    palace_pk = Palace._meta.pk
+    room_table = qn(Room._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {qn(MemoryItem._meta.db_table)} ({", ".join(columns)}) '
+            f'SELECT {", ".join(values)} FROM {qn(MemoryItem._meta.db_table)} item '
+            f'INNER JOIN {room_table} room ON room.{qn("id")} = item.{qn("room_id")} '
+            f'INNER JOIN {room_table} new_room ON new_room.{qn("palace_id")} = %s '
+            f'AND new_room.{qn("order")} = room.{qn("order")} '
+            f'WHERE room.{qn("palace_id")} = %s',
+            [*params, palace_pk.get_db_prep_value(palace.pk, connection),
+             palace_pk.get_db_prep_value(source.pk, connection)],
+        )
+    get_backend().index_palace(palace.pk)
+    schedule_palace_refresh(palace_ids=[palace.pk])
+
+
+@transaction.atomic
+def clone_palace(source, owner, include_items=True, name=None):
+    """Copy ``source`` with its rooms (and items) into a new private palace for ``owner``
+    
+    Study progress is not copied: cloned items start unlearned and due now.
+    Returns the new palace.
+    """
+    palace = Palace.objects.create(
+        owner=owner,
+        name=name or f'{source.name} (copy)',
+        description=source.description,
+        palace_type=source.palace_type,
+        image=source.image.name or None,
+        image_renditions=source.image_renditions,
+        is_public=False,
+    )
+    
+    rooms = [
+        Room(**{**values, 'id': uuid.uuid4(), 'image': values['image'] or None}, palace=palace)
+        for values in Room.objects.filter(palace=source).order_by().values(*ROOM_FIELDS)
+    ]
+    Room.objects.bulk_create(rooms)
+    
+    if include_items and rooms:
+        _copy_items(source, palace)
+    
+    return palace
@@ -0,0 +1,46 @@
+"""
+View decorators for async views.
+
+Django 4.2's ``login_required``, ``staff_member_required`` and
+``require_POST`` only wrap sync functions, and ``request.user`` is loaded
+lazily with a blocking query, so async views use these instead.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseNotAllowed
+from django.urls import reverse
+
+
+def _user(request):
+    # Force the lazy user object while still in a thread where queries are allowed
+    return request.user if request.user.is_authenticated else None
+
+
+def async_login_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if await sync_to_async(_user)(request) is None:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def async_staff_member_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await sync_to_async(_user)(request)
+        if user is None or not (user.is_active and user.is_staff):
+            return redirect_to_login(request.get_full_path(), reverse('admin:login'))
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def async_require_POST(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        return await view(request, *args, **kwargs)
+    return wrapper
@@ -2,6 +2,7 @@ from django import forms
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Submit, Row, Column, Field
 from .models import Palace, Room, MemoryItem
+from .transfer import FORMATS
 
 
 class PalaceForm(forms.ModelForm):
@@ -12,23 +13,23 @@ class PalaceForm(forms.ModelForm):
             'description': forms.Textarea(attrs={'rows': 4}),
         }
     
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.helper = FormHelper()
-        self.helper.layout = Layout(
-            Row(
-                Column('name', css_class='form-group col-md-8 mb-0'),
-                Column('palace_type', css_class='form-group col-md-4 mb-0'),
-                css_class='form-row'
-            ),
-            'description',
-            Row(
-                Column('image', css_class='form-group col-md-8 mb-0'),
-                Column('is_public', css_class='form-group col-md-4 mb-0'),
-                css_class='form-row'
-            ),
-            Submit('submit', 'Save Palace', css_class='btn btn-primary')
-        )
+    # Built once per class rather than per instance; crispy only reads the
+    # helper while rendering
+    helper = FormHelper()
+    helper.layout = Layout(
+        Row(
+            Column('name', css_class='form-group col-md-8 mb-0'),
+            Column('palace_type', css_class='form-group col-md-4 mb-0'),
+            css_class='form-row'
+        ),
+        'description',
+        Row(
+            Column('image', css_class='form-group col-md-8 mb-0'),
+            Column('is_public', css_class='form-group col-md-4 mb-0'),
+            css_class='form-row'
+        ),
+        Submit('submit', 'Save Palace', css_class='btn btn-primary')
+    )
 
 
 class RoomForm(forms.ModelForm):
@@ -41,24 +42,22 @@ class RoomForm(forms.ModelForm):
             'y_coordinate': forms.NumberInput(attrs={'step': '0.1'}),
         }
     
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.helper = FormHelper()
-        self.helper.layout = Layout(
-            Row(
-                Column('name', css_class='form-group col-md-8 mb-0'),
-                Column('order', css_class='form-group col-md-4 mb-0'),
-                css_class='form-row'
-            ),
-            'description',
-            'image',
-            Row(
-                Column('x_coordinate', css_class='form-group col-md-6 mb-0'),
-                Column('y_coordinate', css_class='form-group col-md-6 mb-0'),
-                css_class='form-row'
-            ),
-            Submit('submit', 'Save Room', css_class='btn btn-success')
-        )
+    helper = FormHelper()
+    helper.layout = Layout(
+        Row(
+            Column('name', css_class='form-group col-md-8 mb-0'),
+            Column('order', css_class='form-group col-md-4 mb-0'),
+            css_class='form-row'
+        ),
+        'description',
+        'image',
+        Row(
+            Column('x_coordinate', css_class='form-group col-md-6 mb-0'),
+            Column('y_coordinate', css_class='form-group col-md-6 mb-0'),
+            css_class='form-row'
+        ),
+        Submit('submit', 'Save Room', css_class='btn btn-success')
+    )
 
 
 class MemoryItemForm(forms.ModelForm):
@@ -70,17 +69,35 @@ class MemoryItemForm(forms.ModelForm):
             'mnemonic_hint': forms.Textarea(attrs={'rows': 2}),
         }
     
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.helper = FormHelper()
-        self.helper.layout = Layout(
-            'content',
-            Row(
-                Column('item_type', css_class='form-group col-md-8 mb-0'),
-                Column('position_in_room', css_class='form-group col-md-4 mb-0'),
-                css_class='form-row'
-            ),
-            'mnemonic_hint',
-            'image',
-            Submit('submit', 'Save Memory Item', css_class='btn btn-info')
-        )
\ No newline at end of file
+    helper = FormHelper()
+    helper.layout = Layout(
+        'content',
+        Row(
+            Column('item_type', css_class='form-group col-md-8 mb-0'),
+            Column('position_in_room', css_class='form-group col-md-4 mb-0'),
+            css_class='form-row'
+        ),
+        'mnemonic_hint',
+        'image',
+        Submit('submit', 'Save Memory Item', css_class='btn btn-info')
+    )
+
+
+class PalaceImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV (room, content, item_type, mnemonic_hint), JSON or Anki TSV")
+    format = forms.ChoiceField(choices=FORMATS, initial='csv')
+    default_room = forms.CharField(
+        max_length=200, initial='Imported',
+        help_text="Room for rows that don't name one (all Anki cards go here)"
+    )
+    
+    helper = FormHelper()
+    helper.layout = Layout(
+        'file',
+        Row(
+            Column('format', css_class='form-group col-md-4 mb-0'),
+            Column('default_room', css_class='form-group col-md-8 mb-0'),
+            css_class='form-row'
+        ),
+        Submit('submit', 'Import', css_class='btn btn-primary')
+    )
@@ -0,0 +1,280 @@
+"""
+Off-request image processing.
+
+Saving a palace, room or memory item with a new upload queues an ImageJob.
+The ``process_image_jobs`` worker turns the source into WebP renditions
+stored under ``renditions/<sha256>/``, so a source that was already
+processed (same content, any model) is never resized twice.
+
+Uploads themselves are content-addressed (see palaces.storage). ImageBlob
+rows count how many palaces, rooms and items use each file; the
+``gc_image_blobs`` command recounts them and deletes files left unused.
+"""
+import hashlib
+import logging
+from datetime import timedelta
+from io import BytesIO
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Sum, When
+from django.utils import timezone
+
+from .storage import BLOB_PREFIX, digest_of, image_storage
+
+logger = logging.getLogger(__name__)
+
+# name -> bounding box; templates pick one with the ``rendition`` filter
+RENDITIONS = {
+    'thumb': (160, 160),
+    'card': (480, 480),
+    'full': (1600, 1600),
+}
+RENDITION_FORMAT = 'WEBP'
+RENDITION_QUALITY = 80
+
+MAX_ATTEMPTS = 3
+# Unused blobs are kept this long, so an upload racing the collector is not lost
+BLOB_GRACE = timedelta(hours=24)
+STALE_JOB_AFTER = timedelta(minutes=10)
+
+
+def file_hash(field_file):
+    """SHA-256 of an uploaded file; content-addressed files carry it in their name"""
+    digest = digest_of(field_file.name)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    field_file.open('rb')
+    try:
+        for chunk in field_file.chunks():
+            hasher.update(chunk)
+    finally:
+        field_file.close()
+    return hasher.hexdigest()
+
+
+def rendition_path(digest, name):
+    return f'renditions/{digest[:2]}/{digest}/{name}.webp'
+
+
+def build_renditions(field_file):
+    """Create any missing renditions for ``field_file`` and return the rendition map"""
+    from PIL import Image, ImageOps
+    
+    digest = file_hash(field_file)
+    paths = {name: rendition_path(digest, name) for name in RENDITIONS}
+    missing = [name for name, path in paths.items() if not default_storage.exists(path)]
+    
+    if missing:
+        field_file.open('rb')
+        try:
+            with Image.open(field_file) as img:
+                img = ImageOps.exif_transpose(img)
+                if img.mode not in ('RGB', 'RGBA'):
+                    img = img.convert('RGBA' if img.mode in ('LA', 'P', 'PA') else 'RGB')
+                for name in missing:
+                    rendition = img.copy()
+                    rendition.thumbnail(RENDITIONS[name])
+                    buffer = BytesIO()
+                    rendition.save(buffer, RENDITION_FORMAT, quality=RENDITION_QUALITY)
+                    paths[name] = default_storage.save(paths[name], ContentFile(buffer.getvalue()))
+        finally:
+            field_file.close()
+    
+    return {'source': field_file.name, 'hash': digest, **paths}
+
+
+def existing_renditions(image_name):
+    """The rendition map for a content-addressed image whose renditions were built before, else None
+
+    Lets a re-upload of a known image (or a copy of one) skip the worker.
+    """
+    digest = digest_of(image_name)
+    if digest is None:
+        return None
+    paths = {name: rendition_path(digest, name) for name in RENDITIONS}
+    if not all(default_storage.exists(path) for path in paths.values()):
+        return None
+    return {'source': image_name, 'hash': digest, **paths}
+
+
+def rendition_url(image_name, renditions, name):
+    """URL of rendition ``name`` for a stored image, falling back to the original"""
+    if not image_name:
+        return ''
+    renditions = renditions or {}
+    if renditions.get('source') == image_name and name in renditions:
+        return default_storage.url(renditions[name])
+    return image_storage().url(image_name)
+
+
+def needs_processing(instance):
+    return bool(instance.image) and instance.image_renditions.get('source') != instance.image.name
+
+
+def enqueue(instance):
+    """Queue rendition processing for a model instance with an ``image`` field"""
+    from .models import ImageJob
+    ImageJob.objects.get_or_create(
+        model_label=instance._meta.label,
+        object_id=instance.pk,
+        status=ImageJob.PENDING,
+    )
+
+
+def claim_jobs(limit):
+    """Atomically move up to ``limit`` pending jobs to running and return them"""
+    from .models import ImageJob
+    now = timezone.now()
+    
+    # Jobs left running by a crashed worker go back in the queue
+    ImageJob.objects.filter(status=ImageJob.RUNNING, updated_at__lt=now - STALE_JOB_AFTER).update(
+        status=ImageJob.PENDING
+    )
+    
+    candidates = ImageJob.objects.filter(status=ImageJob.PENDING).order_by('created_at')
+    claimed = []
+    for pk in candidates.values_list('pk', flat=True)[:limit]:
+        won = ImageJob.objects.filter(pk=pk, status=ImageJob.PENDING).update(
+            status=ImageJob.RUNNING, attempts=F('attempts') + 1, updated_at=now
+        )
+        if won:
+            claimed.append(pk)
+    return list(ImageJob.objects.filter(pk__in=claimed))
+
+
+def process_job(job):
+    """Build renditions for one job; finished jobs are deleted, failed ones retried"""
+    from .models import ImageJob, Palace
+    from .signals import schedule_palace_refresh
+    model = apps.get_model(job.model_label)
+    
+    try:
+        instance = model._default_manager.filter(pk=job.object_id).only('pk', 'image', 'image_renditions').first()
+        if instance is not None and needs_processing(instance):
+            renditions = build_renditions(instance.image)
+            # Guarded by the image name so a newer upload is never overwritten
+            model._default_manager.filter(pk=instance.pk, image=instance.image.name).update(
+                image_renditions=renditions
+            )
+            if model is Palace:
+                # Room and item querysets do this in update() themselves
+                schedule_palace_refresh(palace_ids=[instance.pk])
+    except Exception as e:
+        logger.exception("Image job %s failed", job.pk)
+        job.status = ImageJob.FAILED if job.attempts >= MAX_ATTEMPTS else ImageJob.PENDING
+        job.error = str(e)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        return False
+    
+    job.delete()
+    return True
+
+
+def acquire_blob(name):
+    """Count one more row using the blob ``name``"""
+    from .models import ImageBlob
+    if digest_of(name) is None:
+        return
+    if ImageBlob.objects.filter(name=name).update(refcount=F('refcount') + 1, orphaned_at=None):
+        return
+    storage = image_storage()
+    try:
+        with transaction.atomic():
+            ImageBlob.objects.create(name=name, refcount=1, size=storage.size(name) if storage.exists(name) else 0)
+    except IntegrityError:
+        ImageBlob.objects.filter(name=name).update(refcount=F('refcount') + 1, orphaned_at=None)
+
+
+def release_blob(name):
+    """Count one row fewer using the blob ``name``; the last release marks it orphaned"""
+    from .models import ImageBlob
+    if digest_of(name) is None:
+        return
+    ImageBlob.objects.filter(name=name).update(
+        refcount=F('refcount') - 1,
+        orphaned_at=Case(When(refcount__lte=1, then=timezone.now()), default=F('orphaned_at')),
+    )
+
+
+def recount_blobs():
+    """Recompute every blob's reference count from the image columns
+
+    Bulk copies (palace clones, sync) and queryset deletes bypass the
+    per-row counting, so the collector always recounts before deleting.
+    Returns how many blobs were corrected.
+    """
+    from .models import ImageBlob, Palace, Room, MemoryItem
+    counts = {}
+    for model in (Palace, Room, MemoryItem):
+        for name, count in (
+            model.objects.filter(image__startswith=BLOB_PREFIX).order_by()
+            .values_list('image').annotate(n=Count('pk'))
+        ):
+            counts[name] = counts.get(name, 0) + count
+    
+    now = timezone.now()
+    changed = []
+    for blob in ImageBlob.objects.only('name', 'refcount', 'orphaned_at').iterator():
+        refcount = counts.pop(blob.name, 0)
+        if refcount != blob.refcount:
+            blob.refcount = refcount
+            blob.orphaned_at = None if refcount else (blob.orphaned_at or now)
+            changed.append(blob)
+    ImageBlob.objects.bulk_update(changed, ['refcount', 'orphaned_at'], batch_size=500)
+    
+    storage = image_storage()
+    ImageBlob.objects.bulk_create([
+        ImageBlob(name=name, refcount=refcount, size=storage.size(name) if storage.exists(name) else 0)
+        for name, refcount in counts.items()
+    ], ignore_conflicts=True)
+    return len(changed) + len(counts)
+
+
+def adopt_unregistered_blobs():
+    """Register blob files that no ImageBlob row knows about (e.g. a failed upload) as orphans"""
+    from .models import ImageBlob
+    storage = image_storage()
+    known = set(ImageBlob.objects.values_list('name', flat=True))
+    found = []
+    if not storage.exists(BLOB_PREFIX):
+        return 0
+    for directory in storage.listdir(BLOB_PREFIX)[0]:
+        for filename in storage.listdir(f'{BLOB_PREFIX}{directory}')[1]:
+            name = f'{BLOB_PREFIX}{directory}/{filename}'
+            if digest_of(name) and name not in known:
+                found.append(ImageBlob(name=name, size=storage.size(name), orphaned_at=timezone.now()))
+    ImageBlob.objects.bulk_create(found, ignore_conflicts=True)
+    return len(found)
+
+
+def collect_blobs(grace=BLOB_GRACE, dry_run=False):
+    """Delete blobs unused for longer than ``grace``, with their renditions
+
+    Returns ``(count, bytes)`` of what was (or, with ``dry_run``, would be) deleted.
+    """
+    from .models import ImageBlob
+    storage = image_storage()
+    doomed = ImageBlob.objects.filter(refcount__lte=0, orphaned_at__lt=timezone.now() - grace)
+    if dry_run:
+        totals = doomed.aggregate(count=Count('pk'), size=Sum('size'))
+        return totals['count'], totals['size'] or 0
+    
+    count = size = 0
+    for blob in doomed.iterator():
+        # Re-checked row by row: a new upload of the same content revives it
+        deleted, _ = ImageBlob.objects.filter(name=blob.name, refcount__lte=0).delete()
+        if not deleted:
+            continue
+        storage.delete(blob.name)
+        digest = digest_of(blob.name)
+        if not ImageBlob.objects.filter(name__startswith=f'{BLOB_PREFIX}{digest[:2]}/{digest}').exists():
+            # No other spelling of this content is left to use the renditions
+            for name in RENDITIONS:
+                default_storage.delete(rendition_path(digest, name))
+        count += 1
+        size += blob.size
+    return count, size
@@ -0,0 +1,22 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from palaces import progress
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily progress rollups from completed study sessions and their reviews'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only rebuild days from this date (YYYY-MM-DD) on')
+    
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since must be a date like 2024-01-31')
+        written = progress.backfill(since=since)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} daily stats row(s)'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from palaces import retention
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned study sessions and compact old ones into monthly summaries'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what the policy would do')
+        parser.add_argument('--batch-size', type=int, default=retention.DEFAULT_BATCH_SIZE,
+                            help='Sessions per transaction')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches, to throttle load on the database')
+    
+    def handle(self, *args, **options):
+        counts = retention.report()
+        cutoff = retention.compaction_cutoff()
+        self.stdout.write(
+            f"{counts['sessions']} session(s): {counts['abandoned']} abandoned, "
+            f"{counts['expired']} to compact "
+            + (f"(started before {cutoff:%Y-%m-%d})" if cutoff else '(compaction disabled)')
+            + f"; {counts['summaries']} monthly summar{'y' if counts['summaries'] == 1 else 'ies'}"
+        )
+        if options['dry_run']:
+            return
+        
+        batch_size, pause = max(1, options['batch_size']), max(0, options['sleep'])
+        pruned = retention.prune_abandoned(batch_size, pause)
+        compacted = retention.compact_expired(batch_size, pause)
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {pruned} abandoned session(s), compacted {compacted} into monthly summaries'
+        ))
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from palaces import images
+
+
+class Command(BaseCommand):
+    help = 'Recount image blob references and delete blobs no palace, room or item uses'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Recount and report, but delete nothing')
+        parser.add_argument('--grace-hours', type=float, default=images.BLOB_GRACE.total_seconds() / 3600,
+                            help='Only delete blobs unused for at least this long')
+        parser.add_argument('--scan', action='store_true',
+                            help='Also look for blob files in storage that were never registered')
+    
+    def handle(self, *args, **options):
+        corrected = images.recount_blobs()
+        self.stdout.write(f'Corrected {corrected} reference count(s)')
+        if options['scan']:
+            adopted = images.adopt_unregistered_blobs()
+            self.stdout.write(f'Found {adopted} unregistered blob(s)')
+        
+        count, size = images.collect_blobs(
+            grace=timedelta(hours=options['grace_hours']), dry_run=options['dry_run'],
+        )
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {count} unused blob(s), {size / 1048576:.1f} MiB'))
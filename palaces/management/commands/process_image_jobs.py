@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from palaces import images
+from palaces.models import Palace, Room, MemoryItem
+
+
+class Command(BaseCommand):
+    help = 'Run the image rendition worker'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+        parser.add_argument('--batch', type=int, default=20, help='Jobs claimed per poll')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--enqueue-missing', action='store_true',
+                            help='Queue every image that has no renditions yet before starting')
+    
+    def handle(self, *args, **options):
+        if options['enqueue_missing']:
+            self.enqueue_missing()
+        
+        while True:
+            jobs = images.claim_jobs(options['batch'])
+            for job in jobs:
+                ok = images.process_job(job)
+                self.stdout.write(f"{'done' if ok else 'failed'}: {job.model_label} {job.object_id}")
+            
+            if not jobs:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+    
+    def enqueue_missing(self):
+        queued = 0
+        for model in (Palace, Room, MemoryItem):
+            for instance in model.objects.exclude(image='').exclude(image__isnull=True).only(
+                'pk', 'image', 'image_renditions'
+            ).iterator():
+                if images.needs_processing(instance):
+                    images.enqueue(instance)
+                    queued += 1
+        self.stdout.write(f'Queued {queued} image(s)')
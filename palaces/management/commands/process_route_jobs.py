@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from palaces import routing
+
+
+class Command(BaseCommand):
+    help = 'Run the walk route worker'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+        parser.add_argument('--batch', type=int, default=20, help='Jobs claimed per poll')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+    
+    def handle(self, *args, **options):
+        while True:
+            jobs = routing.claim_jobs(options['batch'])
+            for job in jobs:
+                ok = routing.process_job(job)
+                self.stdout.write(f"{'done' if ok else 'failed'}: palace {job.palace_id}")
+            
+            if not jobs:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
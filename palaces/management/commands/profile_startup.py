@@ -0,0 +1,48 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from palaces import startup
+
+
+class Command(BaseCommand):
+    help = 'Measure worker cold start: import time per module and time to the first response'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--entry', choices=['asgi', 'wsgi'], default='asgi', help='Application to load')
+        parser.add_argument('--path', default='/', help='URL of the first request')
+        parser.add_argument('--runs', type=int, default=3, help='Cold starts to take the median of')
+        parser.add_argument('--top', type=int, default=20, help='Slowest modules to list')
+        parser.add_argument('--output', help='Also write the full report to this JSON file')
+    
+    def handle(self, *args, **options):
+        try:
+            report = startup.run(max(1, options['runs']), entry=options['entry'], path=options['path'])
+        except RuntimeError as e:
+            raise CommandError(f'The application failed to start:\n{e}')
+        
+        self.stdout.write(f"{'module':<48}{'self ms':>10}{'total ms':>10}")
+        slowest = sorted(report['modules'], key=lambda module: -module['self_ms'])[:options['top']]
+        for module in slowest:
+            self.stdout.write(f"{module['module']:<48}{module['self_ms']:>10.1f}{module['cumulative_ms']:>10.1f}")
+        
+        self.stdout.write('')
+        self.stdout.write(f"{'package':<48}{'self ms':>10}")
+        for name, ms in startup.by_package(report['modules'])[:options['top']]:
+            self.stdout.write(f'{name:<48}{ms:>10.1f}')
+        
+        self.stdout.write('')
+        self.stdout.write(f"{report['module_count']} modules, median of {report['runs']} cold start(s)")
+        self.stdout.write(f"Application load:  {report['load_ms']:>8.1f} ms ({report['entry']})")
+        self.stdout.write(
+            f"First request:     {report['first_request_ms']:>8.1f} ms "
+            f"(GET {report['path']} -> {report['status']})"
+        )
+        self.stdout.write(f"Process total:     {report['wall_ms']:>8.1f} ms")
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(report, indent=2))
+        if report['eager']:
+            self.stdout.write(self.style.WARNING(
+                f"Imported before the first request: {', '.join(report['eager'])}"
+            ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from palaces import study
+
+
+class Command(BaseCommand):
+    help = 'Write study sessions idle for STUDY_SESSION_IDLE_MINUTES to the database; run every few minutes'
+    
+    def handle(self, *args, **options):
+        finished, dropped = study.reap()
+        self.stdout.write(self.style.SUCCESS(
+            f'Finished {finished} idle study session(s), dropped {dropped} without answers'
+        ))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from palaces.models import Palace, MemoryItem, Room
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized room/item/mastered counters on every palace'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('palace_ids', nargs='*', help='Only rebuild these palaces')
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted palaces without fixing them')
+    
+    def handle(self, *args, **options):
+        palaces = Palace.objects.all()
+        if options['palace_ids']:
+            palaces = palaces.filter(pk__in=options['palace_ids'])
+        
+        drifted = self.find_drifted(palaces)
+        for palace_id, stored, actual in drifted:
+            self.stdout.write(f'{palace_id}: stored {stored}, actual {actual}')
+        
+        if options['dry_run']:
+            self.stdout.write(f'{len(drifted)} palace(s) out of sync')
+            return
+        
+        updated = palaces.refresh_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt counters for {updated} palace(s), {len(drifted)} had drifted'
+        ))
+    
+    def find_drifted(self, palaces):
+        """Compare stored counters with fresh aggregates, two grouped queries in total"""
+        rooms = dict(
+            Room.objects.filter(palace__in=palaces).order_by()
+            .values_list('palace').annotate(n=Count('pk'))
+        )
+        items = {
+            palace_id: (total, mastered)
+            for palace_id, total, mastered in MemoryItem.objects.filter(room__palace__in=palaces).order_by()
+            .values_list('room__palace').annotate(n=Count('pk'), m=Count('pk', filter=Q(is_mastered=True)))
+        }
+        
+        drifted = []
+        for palace_id, room_count, item_count, mastered_count in palaces.values_list(
+            'pk', 'room_count', 'item_count', 'mastered_count'
+        ).iterator():
+            stored = (room_count, item_count, mastered_count)
+            actual = (rooms.get(palace_id, 0),) + items.get(palace_id, (0, 0))
+            if stored != actual:
+                drifted.append((palace_id, stored, actual))
+        return drifted
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from palaces.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for all memory items'
+    
+    def handle(self, *args, **options):
+        backend = get_backend()
+        with transaction.atomic():
+            backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search index ({backend.__class__.__name__})'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from palaces import routing
+from palaces.models import Palace
+
+
+class Command(BaseCommand):
+    help = 'Plan the stored walk route of every palace whose rooms changed since it was planned'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('palace_ids', nargs='*', help='Only rebuild these palaces')
+        parser.add_argument('--full', action='store_true', help='Plan every route from scratch')
+    
+    def handle(self, *args, **options):
+        palace_ids = options['palace_ids'] or Palace.objects.values_list('pk', flat=True)
+        changed = routing.refresh_routes(palace_ids, full=options['full'])
+        engine = 'NumPy' if routing.np is not None else 'pure Python'
+        self.stdout.write(self.style.SUCCESS(f'Planned {changed} walk route(s) with {engine}'))
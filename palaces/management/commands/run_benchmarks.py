@@ -0,0 +1,54 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from palaces import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every palace view against query budgets, latency thresholds and a JSON baseline'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--only', nargs='*', help='URL names to run')
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every request')
+        parser.add_argument('--baseline', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'),
+                            help='Baseline JSON to compare against')
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline')
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+        parser.add_argument('--p95-ms', type=float, default=benchmarks.DEFAULT_P95_MS)
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='Allowed p95 regression over the baseline, as a fraction')
+    
+    def handle(self, *args, **options):
+        try:
+            report = benchmarks.run(options['iterations'], only=options['only'], cold=options['cold'])
+        except LookupError as e:
+            raise CommandError(str(e))
+        
+        self.stdout.write(f"{'view':<22}{'status':>7}{'queries':>9}{'p50 ms':>9}{'p95 ms':>9}{'peak KB':>10}")
+        for name, result in report['results'].items():
+            if result.get('skipped'):
+                self.stdout.write(f"{name:<22}{'skip':>7}  {result['skipped']}")
+                continue
+            self.stdout.write(
+                f"{name:<22}{result['status']:>7}{result['queries']:>5}/{result['query_budget']:<3}"
+                f"{result['p50_ms']:>9}{result['p95_ms']:>9}{result['peak_kb']:>10}"
+            )
+        
+        baseline_path = Path(options['baseline'])
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(report, indent=2))
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(report, indent=2))
+            self.stdout.write(self.style.SUCCESS(f'Saved baseline to {baseline_path}'))
+            return
+        
+        baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else None
+        failures = benchmarks.check(report, baseline, options['tolerance'], options['p95_ms'])
+        if failures:
+            raise CommandError('Benchmark budget exceeded:\n  ' + '\n  '.join(failures))
+        self.stdout.write(self.style.SUCCESS('All views within budget'))
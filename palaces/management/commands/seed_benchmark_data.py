@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from palaces import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Seed synthetic users, palaces, rooms and memory items for run_benchmarks'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--palaces', type=int, default=5, help='Palaces per user')
+        parser.add_argument('--rooms', type=int, default=20, help='Rooms per palace')
+        parser.add_argument('--items', type=int, default=30, help='Memory items per room')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+        parser.add_argument('--clear', action='store_true', help='Delete existing benchmark users first')
+    
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted = benchmarks.clear()
+            self.stdout.write(f'Deleted {deleted} benchmark rows')
+        
+        benchmarks.seed(
+            users=options['users'], palaces=options['palaces'], rooms=options['rooms'],
+            items=options['items'], seed_value=options['seed'], stdout=self.stdout,
+        )
+        total = options['users'] * options['palaces'] * options['rooms'] * options['items']
+        self.stdout.write(self.style.SUCCESS(f'Seeded {total} memory items'))
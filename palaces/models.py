@@ -1,9 +1,53 @@
 from django.db import models
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.urls import reverse
-from PIL import Image
+from django.utils import timezone
 import uuid
 
+from .storage import image_storage
+
+
+def _assigned_pk(update_kwargs, field):
+    """The FK value an update() assigns to ``field``, if it is a plain value"""
+    value = update_kwargs.get(field, update_kwargs.get(f'{field}_id'))
+    if hasattr(value, 'resolve_expression'):
+        return None
+    return getattr(value, 'pk', value)
+
+
+class PalaceQuerySet(models.QuerySet):
+    def refresh_counters(self):
+        """Recompute the denormalized room/item counters in a single UPDATE"""
+        rooms = (
+            Room.objects.filter(palace=OuterRef('pk'))
+            .order_by().values('palace').annotate(n=Count('pk')).values('n')
+        )
+        items = (
+            MemoryItem.objects.filter(room__palace=OuterRef('pk'))
+            .order_by().values('room__palace').annotate(n=Count('pk')).values('n')
+        )
+        mastered = (
+            MemoryItem.objects.filter(room__palace=OuterRef('pk'), is_mastered=True)
+            .order_by().values('room__palace').annotate(n=Count('pk')).values('n')
+        )
+        sessions = (
+            StudySession.objects.filter(palace=OuterRef('pk'))
+            .order_by().values('palace').annotate(n=Count('pk')).values('n')
+        )
+        # Sessions folded into monthly summaries by palaces.retention still count
+        compacted = (
+            MonthlyStudySummary.objects.filter(palace=OuterRef('pk'))
+            .order_by().values('palace').annotate(n=Sum('sessions')).values('n')
+        )
+        return self.update(
+            room_count=Coalesce(Subquery(rooms), 0),
+            item_count=Coalesce(Subquery(items), 0),
+            mastered_count=Coalesce(Subquery(mastered), 0),
+            study_count=Coalesce(Subquery(sessions), 0) + Coalesce(Subquery(compacted), 0),
+        )
+
 
 class Palace(models.Model):
     """A memory palace - a familiar location used for memory training"""
@@ -23,28 +67,73 @@ class Palace(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     palace_type = models.CharField(max_length=20, choices=PALACE_TYPES, default='house')
-    image = models.ImageField(upload_to='palace_images/', blank=True, null=True)
+    image = models.ImageField(upload_to='palace_images/', storage=image_storage, blank=True, null=True)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     is_public = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Denormalized counters, kept in sync by palaces.signals and study_session views
+    room_count = models.PositiveIntegerField(default=0, editable=False)
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    mastered_count = models.PositiveIntegerField(default=0, editable=False)
+    study_count = models.PositiveIntegerField(default=0, editable=False)
+    # Planned walk through the rooms, maintained by palaces.routing
+    walk_route = models.JSONField(default=dict, blank=True, editable=False)
+    
+    objects = PalaceQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of the public gallery, see palaces.pagination
+            models.Index(fields=['-created_at', '-id'], name='palace_public_newest_idx',
+                         condition=Q(is_public=True)),
+            models.Index(fields=['-study_count', '-id'], name='palace_public_popular_idx',
+                         condition=Q(is_public=True)),
+            # Delta sync, see palaces.sync
+            models.Index(fields=['owner', 'updated_at', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.owner.username})"
     
     def get_absolute_url(self):
         return reverse('palace_detail', kwargs={'pk': self.pk})
+
+
+# Room fields whose change invalidates the palace's walk route (``order``
+# decides which room is the entrance)
+ROUTE_FIELDS = {'x_coordinate', 'y_coordinate', 'order', 'palace', 'palace_id'}
+
+
+class RoomQuerySet(models.QuerySet):
+    """Schedules palace counter refreshes for bulk writes that skip signals
+
+    ``update()`` also stamps ``updated_at``, which auto_now leaves alone.
+    """
     
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        if self.image:
-            img = Image.open(self.image.path)
-            if img.height > 800 or img.width > 800:
-                output_size = (800, 800)
-                img.thumbnail(output_size)
-                img.save(self.image.path)
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        from .signals import schedule_palace_refresh
+        palace_ids = {obj.palace_id for obj in objs}
+        schedule_palace_refresh(palace_ids=palace_ids, reroute_ids=palace_ids)
+        return objs
+    
+    def update(self, **kwargs):
+        palace_ids = set(self.order_by().values_list('palace_id', flat=True).distinct())
+        moves = 'palace' in kwargs or 'palace_id' in kwargs
+        if moves:
+            room_ids = list(self.values_list('pk', flat=True))
+        kwargs.setdefault('updated_at', timezone.now())
+        rows = super().update(**kwargs)
+        from .signals import schedule_palace_refresh
+        if moves:
+            MemoryItem.objects.filter(room__in=room_ids).copy_room_palace()
+        palace_ids |= {_assigned_pk(kwargs, 'palace')}
+        moved = ROUTE_FIELDS.intersection(kwargs)
+        schedule_palace_refresh(palace_ids=palace_ids, reroute_ids=palace_ids if moved else ())
+        return rows
 
 
 class Room(models.Model):
@@ -54,13 +143,20 @@ class Room(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     order = models.PositiveIntegerField(default=0)
-    image = models.ImageField(upload_to='room_images/', blank=True, null=True)
+    image = models.ImageField(upload_to='room_images/', storage=image_storage, blank=True, null=True)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     x_coordinate = models.FloatField(default=0.0, help_text="X position in palace layout")
     y_coordinate = models.FloatField(default=0.0, help_text="Y position in palace layout")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = RoomQuerySet.as_manager()
     
     class Meta:
         ordering = ['order', 'name']
         unique_together = ['palace', 'order']
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.name} - {self.palace.name}"
@@ -69,6 +165,61 @@ class Room(models.Model):
         return reverse('room_detail', kwargs={'palace_pk': self.palace.pk, 'pk': self.pk})
 
 
+# MemoryItem fields copied into the full-text index, see palaces.search
+SEARCH_FIELDS = {'content', 'mnemonic_hint', 'room', 'room_id'}
+
+
+class MemoryItemQuerySet(models.QuerySet):
+    """Schedules palace counter refreshes for bulk writes that skip signals
+
+    ``update()`` also stamps ``updated_at``, which auto_now leaves alone.
+    """
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            if obj.palace_id is None and MemoryItem.room.is_cached(obj):
+                obj.palace_id = obj.room.palace_id
+        missing = {obj.room_id for obj in objs if obj.palace_id is None}
+        if missing:
+            palaces = dict(Room.objects.filter(pk__in=missing).values_list('pk', 'palace_id'))
+            for obj in objs:
+                if obj.palace_id is None:
+                    obj.palace_id = palaces.get(obj.room_id)
+        objs = super().bulk_create(objs, *args, **kwargs)
+        from .search import get_backend
+        from .signals import schedule_palace_refresh
+        schedule_palace_refresh(room_ids={obj.room_id for obj in objs})
+        get_backend().index_items([obj.pk for obj in objs])
+        return objs
+    
+    def due(self, palace, now=None):
+        """Items in a palace whose next review is due, most overdue first"""
+        return self.filter(
+            palace=palace, next_due__lte=now or timezone.now()
+        ).order_by('next_due')
+    
+    def copy_room_palace(self):
+        """Set ``palace`` from each item's room, after rooms or items moved"""
+        return super().update(palace_id=Subquery(Room.objects.filter(pk=OuterRef('room_id')).values('palace_id')))
+    
+    def update(self, **kwargs):
+        room_ids = set(self.order_by().values_list('room_id', flat=True).distinct())
+        reindex = SEARCH_FIELDS.intersection(kwargs)
+        if reindex:
+            item_ids = list(self.values_list('pk', flat=True))
+        kwargs.setdefault('updated_at', timezone.now())
+        rows = super().update(**kwargs)
+        from .search import get_backend
+        from .signals import schedule_palace_refresh
+        if 'room' in kwargs or 'room_id' in kwargs:
+            MemoryItem.objects.filter(pk__in=item_ids).copy_room_palace()
+        schedule_palace_refresh(room_ids=room_ids | {_assigned_pk(kwargs, 'room')})
+        if reindex:
+            get_backend().index_items(item_ids)
+        return rows
+
+
 class MemoryItem(models.Model):
     """An item to be remembered, placed in a specific location within a room"""
     ITEM_TYPES = [
@@ -83,21 +234,46 @@ class MemoryItem(models.Model):
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='memory_items')
+    # Denormalized from the room, so due() is a range scan on (palace, next_due)
+    palace = models.ForeignKey(Palace, on_delete=models.CASCADE, related_name='memory_items', editable=False)
     content = models.TextField(help_text="What you want to remember")
     item_type = models.CharField(max_length=20, choices=ITEM_TYPES, default='text')
     mnemonic_hint = models.TextField(blank=True, help_text="Memory aid or association")
     position_in_room = models.PositiveIntegerField(default=1)
-    image = models.ImageField(upload_to='memory_items/', blank=True, null=True)
+    image = models.ImageField(upload_to='memory_items/', storage=image_storage, blank=True, null=True)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     is_mastered = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    last_reviewed = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    last_reviewed = models.DateTimeField(null=True, blank=True)
+    
+    # SM-2 scheduling state, see palaces.scheduling
+    ease_factor = models.FloatField(default=2.5)
+    interval_days = models.PositiveIntegerField(default=0)
+    repetitions = models.PositiveIntegerField(default=0)
+    next_due = models.DateTimeField(default=timezone.now)
+    
+    objects = MemoryItemQuerySet.as_manager()
     
     class Meta:
         ordering = ['position_in_room', 'created_at']
         unique_together = ['room', 'position_in_room']
+        indexes = [
+            models.Index(fields=['palace', 'next_due']),
+            models.Index(fields=['created_at']),
+            models.Index(fields=['updated_at', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.content[:50]}... - {self.room.name}"
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'room', 'room_id'}.intersection(update_fields):
+            self.palace_id = self.room.palace_id
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'palace'}
+        super().save(*args, **kwargs)
 
 
 class StudySession(models.Model):
@@ -105,7 +281,7 @@ class StudySession(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='study_sessions')
     palace = models.ForeignKey(Palace, on_delete=models.CASCADE, related_name='study_sessions')
-    started_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(default=timezone.now)
     completed_at = models.DateTimeField(null=True, blank=True)
     items_reviewed = models.PositiveIntegerField(default=0)
     items_mastered = models.PositiveIntegerField(default=0)
@@ -113,6 +289,9 @@ class StudySession(models.Model):
     
     class Meta:
         ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['started_at']),
+        ]
     
     def __str__(self):
         return f"Study session: {self.palace.name} - {self.started_at.strftime('%Y-%m-%d %H:%M')}"
@@ -121,4 +300,217 @@ class StudySession(models.Model):
     def duration(self):
         if self.completed_at:
             return self.completed_at - self.started_at
-        return None
\ No newline at end of file
+        return None
+    
+    def set_totals(self, totals):
+        """Set the results from ``{'reviewed': n, 'correct': n}`` (does not save)"""
+        self.items_reviewed = totals['reviewed']
+        self.items_mastered = totals['correct']
+        self.accuracy_score = (self.items_mastered / self.items_reviewed * 100) if self.items_reviewed else 0.0
+        return self
+
+
+class ReviewEvent(models.Model):
+    """A single recall attempt on a memory item; rows are append-only"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='review_events')
+    item = models.ForeignKey(MemoryItem, on_delete=models.CASCADE, related_name='review_events')
+    session = models.ForeignKey(
+        StudySession, on_delete=models.SET_NULL, null=True, blank=True, related_name='review_events'
+    )
+    grade = models.PositiveSmallIntegerField(help_text="SM-2 recall grade, 0-5")
+    response_time_ms = models.PositiveIntegerField(null=True, blank=True)
+    reviewed_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-reviewed_at']
+        indexes = [
+            models.Index(fields=['user', 'reviewed_at']),
+            models.Index(fields=['reviewed_at']),
+        ]
+    
+    def __str__(self):
+        return f"Review of {self.item_id}: grade {self.grade}"
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Review events are append-only")
+        super().save(*args, **kwargs)
+
+
+class DailyStats(models.Model):
+    """One day of study results, maintained incrementally by palaces.progress"""
+    day = models.DateField()
+    sessions = models.PositiveIntegerField(default=0)
+    items_reviewed = models.PositiveIntegerField(default=0)
+    items_correct = models.PositiveIntegerField(default=0)
+    seconds_studied = models.PositiveIntegerField(default=0)
+    # Net change in mastered items; negative when items lapse
+    mastered_change = models.IntegerField(default=0)
+    
+    class Meta:
+        abstract = True
+        ordering = ['day']
+    
+    @property
+    def accuracy(self):
+        return (self.items_correct / self.items_reviewed * 100) if self.items_reviewed else 0.0
+
+
+class UserDailyStats(DailyStats):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats')
+    # Consecutive study days ending with this one
+    streak = models.PositiveIntegerField(default=1)
+    
+    class Meta(DailyStats.Meta):
+        verbose_name_plural = 'user daily stats'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='unique_user_daily_stats'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} on {self.day}"
+
+
+class PalaceDailyStats(DailyStats):
+    palace = models.ForeignKey(Palace, on_delete=models.CASCADE, related_name='daily_stats')
+    
+    class Meta(DailyStats.Meta):
+        verbose_name_plural = 'palace daily stats'
+        constraints = [
+            models.UniqueConstraint(fields=['palace', 'day'], name='unique_palace_daily_stats'),
+        ]
+    
+    def __str__(self):
+        return f"{self.palace} on {self.day}"
+
+
+class MonthlyStudySummary(models.Model):
+    """Totals of a user's completed sessions on a palace for one month, kept after the sessions are compacted"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_study_summaries')
+    palace = models.ForeignKey(Palace, on_delete=models.CASCADE, related_name='monthly_study_summaries')
+    month = models.DateField(help_text="First day of the month")
+    sessions = models.PositiveIntegerField(default=0)
+    items_reviewed = models.PositiveIntegerField(default=0)
+    items_mastered = models.PositiveIntegerField(default=0)
+    seconds_studied = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-month']
+        verbose_name_plural = 'monthly study summaries'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'palace', 'month'], name='unique_monthly_study_summary'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} on {self.palace} in {self.month:%Y-%m}"
+    
+    @property
+    def accuracy(self):
+        return (self.items_mastered / self.items_reviewed * 100) if self.items_reviewed else 0.0
+
+
+class ImageBlob(models.Model):
+    """A stored image file and how many palaces, rooms and items use it, see palaces.storage"""
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.IntegerField(default=0)
+    # When refcount last dropped to zero; gc_image_blobs deletes the file after a grace period
+    orphaned_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['orphaned_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.refcount} reference{'s' if self.refcount != 1 else ''})"
+
+
+class ImageJob(models.Model):
+    """A queued rendition build for an uploaded image, see palaces.images"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+    
+    model_label = models.CharField(max_length=100)
+    object_id = models.UUIDField()
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.model_label} {self.object_id} ({self.status})"
+
+
+class RouteJob(models.Model):
+    """A queued walk route re-plan for a palace, see palaces.routing"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+    
+    palace = models.OneToOneField(Palace, on_delete=models.CASCADE, primary_key=True, related_name='route_job')
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.palace_id} ({self.status})"
+
+
+class Tombstone(models.Model):
+    """Marks a deleted palace, room or item for syncing clients, see palaces.sync
+    
+    Only the root of a cascade is recorded: clients drop a palace's rooms and
+    items, or a room's items, along with it.
+    """
+    PALACE = 'palace'
+    ROOM = 'room'
+    ITEM = 'item'
+    KINDS = [
+        (PALACE, 'Palace'),
+        (ROOM, 'Room'),
+        (ITEM, 'Memory item'),
+    ]
+    
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tombstones')
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.UUIDField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['deleted_at']
+        indexes = [
+            models.Index(fields=['owner', 'deleted_at', 'id']),
+            models.Index(fields=['deleted_at']),
+        ]
+    
+    def __str__(self):
+        return f"Deleted {self.kind} {self.object_id}"
@@ -0,0 +1,65 @@
+"""
+Bulk reordering of rooms within a palace and items within a room.
+
+``order``/``position_in_room`` are unique per parent, so assigning a new
+permutation row by row collides with rows that have not moved yet. Instead
+every row is first shifted above the current maximum in one UPDATE, then
+the final positions are written with one ``bulk_update`` (a CASE per batch).
+Neither step can produce a duplicate at any point, and the parent row is
+locked first so concurrent reorders of the same palace or room queue up.
+"""
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+
+from .models import Palace, Room, MemoryItem
+
+MAX_REORDER_SIZE = 5000
+
+
+def parse_order(payload):
+    """Validate a decoded JSON payload like ``{"order": [<uuid>, ...]}`` into a list of UUIDs"""
+    order = payload.get('order') if isinstance(payload, dict) else None
+    if not isinstance(order, list):
+        raise ValidationError("Expected an 'order' list")
+    if len(order) > MAX_REORDER_SIZE:
+        raise ValidationError(f"At most {MAX_REORDER_SIZE} entries per request")
+    try:
+        ids = [uuid.UUID(str(pk)) for pk in order]
+    except ValueError:
+        raise ValidationError("Order contains an invalid id")
+    if len(set(ids)) != len(ids):
+        raise ValidationError("Order contains duplicate ids")
+    return ids
+
+
+def _reorder(queryset, field, ids):
+    objs = list(queryset.only('pk', field))
+    if {obj.pk for obj in objs} != set(ids):
+        raise ValidationError("Order must list every entry exactly once")
+    if not objs:
+        return
+    
+    offset = max(getattr(obj, field) for obj in objs) + len(objs) + 1
+    queryset.update(**{field: F(field) + offset})
+    
+    position = {pk: index for index, pk in enumerate(ids, start=1)}
+    for obj in objs:
+        setattr(obj, field, position[obj.pk])
+    queryset.model.objects.bulk_update(objs, [field])
+
+
+@transaction.atomic
+def reorder_rooms(palace, room_ids):
+    """Give the rooms of ``palace`` orders 1..n following ``room_ids``"""
+    Palace.objects.select_for_update().only('pk').get(pk=palace.pk)
+    _reorder(Room.objects.filter(palace=palace), 'order', room_ids)
+
+
+@transaction.atomic
+def reorder_items(room, item_ids):
+    """Give the items of ``room`` positions 1..n following ``item_ids``"""
+    Room.objects.select_for_update().only('pk').get(pk=room.pk)
+    _reorder(MemoryItem.objects.filter(room=room), 'position_in_room', item_ids)
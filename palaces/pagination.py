@@ -0,0 +1,130 @@
+"""
+Keyset (cursor) pagination, and an estimated-count paginator for the admin.
+
+Instead of OFFSET/COUNT, each page remembers the sort key of its last row
+and the next page asks for rows strictly after it, which an index on the
+sort columns answers in constant time however deep the page is.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else str(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+    
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+    
+    def __iter__(self):
+        return iter(self.object_list)
+    
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """Paginate a queryset in descending order of ``keys`` (the last key must be unique)"""
+    
+    def __init__(self, queryset, keys, per_page):
+        self.queryset = queryset
+        self.keys = keys
+        self.per_page = per_page
+    
+    def _after(self, values):
+        """Rows sorting strictly after ``values`` in descending key order"""
+        meta = self.queryset.model._meta
+        try:
+            parsed = [meta.get_field(key).to_python(value) for key, value in zip(self.keys, values)]
+        except ValidationError:
+            raise InvalidCursor(values)
+        
+        condition = Q()
+        for index, key in enumerate(self.keys):
+            equal = dict(zip(self.keys[:index], parsed[:index]))
+            condition |= Q(**equal, **{f'{key}__lt': parsed[index]})
+        return condition
+    
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*[f'-{key}' for key in self.keys])
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != len(self.keys):
+                raise InvalidCursor(cursor)
+            queryset = queryset.filter(self._after(values))
+        
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = encode_cursor([getattr(rows[-1], key) for key in self.keys])
+        return KeysetPage(rows, next_cursor)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that trusts the planner's row estimate for unfiltered large tables
+
+    ``COUNT(*)`` scans the whole table. When the queryset has no filters and
+    the database statistics say the table holds more than ``threshold``
+    rows, that estimate is used instead; otherwise the exact count is.
+    """
+    threshold = 10000
+    
+    def _estimate(self):
+        queryset = self.object_list
+        if getattr(queryset, 'query', None) is None or queryset.query.where:
+            return None
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            elif connection.vendor == 'sqlite':
+                # sqlite_stat1 exists once ANALYZE (or PRAGMA optimize) has run
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+                if cursor.fetchone() is None:
+                    return None
+                # the first number of every row for a table is its row count
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            else:
+                return None
+            row = cursor.fetchone()
+        if row is None or row[0] is None:
+            return None
+        return int(str(row[0]).split()[0])
+    
+    @cached_property
+    def count(self):
+        estimate = self._estimate()
+        if estimate is not None and estimate > self.threshold:
+            return estimate
+        return super().count
@@ -0,0 +1,210 @@
+"""
+Daily progress rollups.
+
+Each completed study session is added to one row per day for its user
+(UserDailyStats) and its palace (PalaceDailyStats): sessions, answers,
+correct answers, time studied and the net change in mastered items. User
+rows also carry the study streak ending that day. A year of history, and
+with it the current streak, is then one indexed range query instead of a
+scan over every session. ``backfill`` rebuilds the rows from the session
+and review history.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import MemoryItem, MonthlyStudySummary, ReviewEvent, StudySession, UserDailyStats, PalaceDailyStats
+from .scheduling import apply_review, PASSING_GRADE
+
+HISTORY_DAYS = 365
+MAX_HISTORY_DAYS = 3 * 365
+COUNTER_FIELDS = ['sessions', 'items_reviewed', 'items_correct', 'seconds_studied', 'mastered_change']
+
+
+def increment(model, keys, values):
+    """Add ``values`` to the row for ``keys``, creating it; returns whether it was created"""
+    changes = {field: F(field) + value for field, value in values.items()}
+    if model.objects.filter(**keys).update(**changes):
+        return False
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **values)
+        return True
+    except IntegrityError:
+        # Created by a concurrent session
+        model.objects.filter(**keys).update(**changes)
+        return False
+
+
+def _relink_streaks(user_id, day):
+    """Recompute streaks from ``day`` on, after a row for it was created"""
+    rows = list(
+        UserDailyStats.objects.filter(user_id=user_id, day__gte=day - timedelta(days=1))
+        .only('pk', 'day', 'streak').order_by('day')
+    )
+    previous = rows.pop(0) if rows and rows[0].day < day else None
+    changed = []
+    for row in rows:
+        streak = previous.streak + 1 if previous and row.day - previous.day == timedelta(days=1) else 1
+        if streak != row.streak:
+            row.streak = streak
+            changed.append(row)
+        previous = row
+    UserDailyStats.objects.bulk_update(changed, ['streak'])
+
+
+def record_session(session, reviews, mastered_change=0):
+    """Add a completed session to the rollups
+    
+    ``reviews`` are ``(reviewed_at, grade)`` pairs; each counts on its own
+    day, while the session and its duration count on the day it completed.
+    """
+    by_day = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    for reviewed_at, grade in reviews:
+        totals = by_day[timezone.localdate(reviewed_at)]
+        totals['items_reviewed'] += 1
+        totals['items_correct'] += grade >= PASSING_GRADE
+    totals = by_day[timezone.localdate(session.completed_at)]
+    totals['sessions'] += 1
+    totals['seconds_studied'] += max(0, int((session.completed_at - session.started_at).total_seconds()))
+    totals['mastered_change'] += mastered_change
+    
+    for day, values in sorted(by_day.items()):
+        values = {field: value for field, value in values.items() if value}
+        increment(PalaceDailyStats, {'palace_id': session.palace_id, 'day': day}, values)
+        if increment(UserDailyStats, {'user_id': session.user_id, 'day': day}, values):
+            _relink_streaks(session.user_id, day)
+
+
+def history(queryset, days=HISTORY_DAYS):
+    """Rows of a rollup queryset for the last ``days`` days, oldest first"""
+    start = timezone.localdate() - timedelta(days=days - 1)
+    return queryset.filter(day__gte=start).order_by('day')
+
+
+def summary(rows):
+    """JSON-ready series and streaks for rows from ``history``"""
+    today = timezone.localdate()
+    streaks = [row.streak for row in rows if hasattr(row, 'streak')]
+    current = rows[-1].streak if streaks and rows[-1].day >= today - timedelta(days=1) else 0
+    return {
+        'days': [
+            {
+                'day': row.day.isoformat(),
+                'sessions': row.sessions,
+                'items_reviewed': row.items_reviewed,
+                'accuracy': round(row.accuracy, 1),
+                'seconds_studied': row.seconds_studied,
+                'mastered_change': row.mastered_change,
+            }
+            for row in rows
+        ],
+        'current_streak': current,
+        'longest_streak': max(streaks, default=0),
+    }
+
+
+def _mastery_changes(since):
+    """Net mastered-item changes per (user, palace, day), replayed from the review log
+    
+    Each item's reviews are replayed through SM-2 from a new item's state.
+    Mastery toggled by hand is not a review and is not counted.
+    """
+    changes = defaultdict(int)
+    events = (
+        ReviewEvent.objects.order_by('item_id', 'reviewed_at')
+        .values_list('item_id', 'grade', 'reviewed_at', 'session__palace_id', 'user_id', 'session__completed_at')
+    )
+    item_id = item = None
+    for event_item_id, grade, reviewed_at, palace_id, user_id, completed_at in events.iterator(chunk_size=5000):
+        if event_item_id != item_id:
+            item_id, item = event_item_id, MemoryItem()
+        was_mastered = item.is_mastered
+        apply_review(item, grade, reviewed_at)
+        if palace_id is None or completed_at is None or item.is_mastered == was_mastered:
+            continue
+        day = timezone.localdate(completed_at)
+        if since is None or day >= since:
+            changes[user_id, palace_id, day] += 1 if item.is_mastered else -1
+    return changes
+
+
+@transaction.atomic
+def backfill(since=None, batch_size=1000):
+    """Rebuild every rollup row from ``since`` (a date, default all time); returns rows written
+
+    Days whose sessions were compacted away (see palaces.retention) are
+    never rebuilt, as their sessions no longer exist.
+    """
+    compacted = MonthlyStudySummary.objects.aggregate(month=Max('month'))['month']
+    if compacted is not None:
+        first_kept = (compacted + timedelta(days=31)).replace(day=1)
+        since = max(since, first_kept) if since else first_kept
+    
+    sessions = StudySession.objects.filter(completed_at__isnull=False)
+    events = ReviewEvent.objects.filter(session__completed_at__isnull=False)
+    if since is not None:
+        UserDailyStats.objects.filter(day__gte=since).delete()
+        PalaceDailyStats.objects.filter(day__gte=since).delete()
+        sessions = sessions.filter(completed_at__date__gte=since)
+        events = events.filter(reviewed_at__date__gte=since)
+    else:
+        UserDailyStats.objects.all().delete()
+        PalaceDailyStats.objects.all().delete()
+    
+    rows = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    for user_id, palace_id, day, count, duration in (
+        sessions.annotate(day=TruncDate('completed_at'))
+        .values_list('user_id', 'palace_id', 'day')
+        .annotate(count=Count('pk'), duration=Sum(ExpressionWrapper(
+            F('completed_at') - F('started_at'), output_field=DurationField(),
+        )))
+        .order_by()
+    ):
+        rows[user_id, palace_id, day]['sessions'] += count
+        rows[user_id, palace_id, day]['seconds_studied'] += max(0, int(duration.total_seconds())) if duration else 0
+    for user_id, palace_id, day, reviewed, correct in (
+        events.annotate(day=TruncDate('reviewed_at'))
+        .values_list('user_id', 'session__palace_id', 'day')
+        .annotate(reviewed=Count('pk'), correct=Count('pk', filter=Q(grade__gte=PASSING_GRADE)))
+        .order_by()
+    ):
+        rows[user_id, palace_id, day]['items_reviewed'] += reviewed
+        rows[user_id, palace_id, day]['items_correct'] += correct
+    for key, change in _mastery_changes(since).items():
+        rows[key]['mastered_change'] += change
+    
+    by_user = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    by_palace = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    for (user_id, palace_id, day), values in rows.items():
+        for field, value in values.items():
+            by_user[user_id, day][field] += value
+            by_palace[palace_id, day][field] += value
+    
+    PalaceDailyStats.objects.bulk_create(
+        [PalaceDailyStats(palace_id=palace_id, day=day, **values) for (palace_id, day), values in by_palace.items()],
+        batch_size=batch_size,
+    )
+    user_rows = [
+        UserDailyStats(user_id=user_id, day=day, **values)
+        for (user_id, day), values in sorted(by_user.items(), key=lambda entry: entry[0])
+    ]
+    previous = {}
+    if since is not None:
+        # Streaks continue from the last day kept
+        day_before = since - timedelta(days=1)
+        previous = dict(
+            UserDailyStats.objects.filter(day=day_before).values_list('user_id', 'streak')
+        )
+    for index, row in enumerate(user_rows):
+        before = user_rows[index - 1] if index else None
+        if before is not None and before.user_id == row.user_id:
+            row.streak = before.streak + 1 if row.day - before.day == timedelta(days=1) else 1
+        elif since is not None and row.day == since:
+            row.streak = previous.get(row.user_id, 0) + 1
+    UserDailyStats.objects.bulk_create(user_rows, batch_size=batch_size)
+    return len(user_rows) + len(by_palace)
@@ -0,0 +1,107 @@
+"""
+Retention for StudySession history.
+
+Two rules, both from settings:
+
+* sessions never completed (left over from before sessions were kept in
+  the cache until completion) are deleted once older than
+  ``STUDY_SESSION_ABANDONED_DAYS``;
+* completed sessions from whole months older than
+  ``STUDY_SESSION_RETENTION_DAYS`` are folded into MonthlyStudySummary rows
+  and deleted.
+
+Work is done in batches of primary keys, each in its own short transaction,
+with an optional pause in between, so neither rule holds long locks on a
+large table. Review events keep their rows; their session link is cleared.
+"""
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MonthlyStudySummary, StudySession
+from .progress import increment
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def abandoned_cutoff():
+    return timezone.now() - timedelta(days=settings.STUDY_SESSION_ABANDONED_DAYS)
+
+
+def compaction_cutoff():
+    """Start of the oldest month that is kept in full, or None when compaction is off"""
+    if not settings.STUDY_SESSION_RETENTION_DAYS:
+        return None
+    day = timezone.localdate() - timedelta(days=settings.STUDY_SESSION_RETENTION_DAYS)
+    return timezone.make_aware(datetime.combine(day.replace(day=1), datetime.min.time()))
+
+
+def abandoned_sessions():
+    return StudySession.objects.filter(completed_at__isnull=True, started_at__lt=abandoned_cutoff())
+
+
+def expired_sessions():
+    cutoff = compaction_cutoff()
+    if cutoff is None:
+        return StudySession.objects.none()
+    return StudySession.objects.filter(completed_at__isnull=False, started_at__lt=cutoff)
+
+
+def report():
+    """Row counts each rule would act on"""
+    return {
+        'sessions': StudySession.objects.count(),
+        'abandoned': abandoned_sessions().count(),
+        'expired': expired_sessions().count(),
+        'summaries': MonthlyStudySummary.objects.count(),
+    }
+
+
+def _in_batches(queryset, apply, batch_size, pause):
+    """Call ``apply(pks)`` in a transaction per batch until ``queryset`` is empty; returns the row count"""
+    total = 0
+    while True:
+        pks = list(queryset.order_by('started_at').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return total
+        with transaction.atomic():
+            apply(pks)
+        total += len(pks)
+        if len(pks) < batch_size:
+            return total
+        if pause:
+            time.sleep(pause)
+
+
+def _delete(pks):
+    StudySession.objects.filter(pk__in=pks).delete()
+
+
+def _compact(pks):
+    months = defaultdict(lambda: {'sessions': 0, 'items_reviewed': 0, 'items_mastered': 0, 'seconds_studied': 0})
+    sessions = StudySession.objects.filter(pk__in=pks).select_for_update().values_list(
+        'user_id', 'palace_id', 'started_at', 'completed_at', 'items_reviewed', 'items_mastered',
+    )
+    for user_id, palace_id, started_at, completed_at, reviewed, mastered in sessions:
+        totals = months[user_id, palace_id, timezone.localdate(started_at).replace(day=1)]
+        totals['sessions'] += 1
+        totals['items_reviewed'] += reviewed
+        totals['items_mastered'] += mastered
+        totals['seconds_studied'] += max(0, int((completed_at - started_at).total_seconds()))
+    for (user_id, palace_id, month), values in months.items():
+        increment(MonthlyStudySummary, {'user_id': user_id, 'palace_id': palace_id, 'month': month}, values)
+    _delete(pks)
+
+
+def prune_abandoned(batch_size=DEFAULT_BATCH_SIZE, pause=0):
+    """Delete sessions that were never completed; returns how many"""
+    return _in_batches(abandoned_sessions(), _delete, batch_size, pause)
+
+
+def compact_expired(batch_size=DEFAULT_BATCH_SIZE, pause=0):
+    """Fold old completed sessions into monthly summaries; returns how many were compacted"""
+    return _in_batches(expired_sessions(), _compact, batch_size, pause)
@@ -0,0 +1,71 @@
+"""
+Batched review submission: validate a list of recall results, append them
+to the ReviewEvent log and reschedule the affected items in one transaction.
+"""
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MemoryItem, ReviewEvent
+from .scheduling import apply_review, MAX_GRADE, SCHEDULING_FIELDS
+
+MAX_BATCH_SIZE = 500
+
+
+def parse_reviews(payload):
+    """Validate a decoded JSON payload into a list of (item_id, grade, response_time_ms)"""
+    reviews = payload.get('reviews') if isinstance(payload, dict) else None
+    if not isinstance(reviews, list):
+        raise ValidationError("Expected a 'reviews' list")
+    if len(reviews) > MAX_BATCH_SIZE:
+        raise ValidationError(f"At most {MAX_BATCH_SIZE} reviews per request")
+    
+    parsed = []
+    for index, review in enumerate(reviews):
+        try:
+            item_id = uuid.UUID(str(review['item']))
+            grade = int(review['grade'])
+            response_time = review.get('response_time_ms')
+            response_time = None if response_time is None else max(0, int(response_time))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValidationError(f"Review {index} is malformed")
+        if not 0 <= grade <= MAX_GRADE:
+            raise ValidationError(f"Review {index} has a grade outside 0-{MAX_GRADE}")
+        parsed.append((item_id, grade, response_time))
+    return parsed
+
+
+@transaction.atomic
+def record_reviews(user, palace, reviews, session=None, reviewed_at=None, skip_missing=False):
+    """Apply parsed reviews to items in ``palace``; returns the updated items
+
+    A review may carry its own time as a fourth element, otherwise
+    ``reviewed_at`` (default now) is used. Unknown items raise
+    ValidationError unless ``skip_missing``, when their reviews are dropped.
+    Costs a constant number of queries regardless of batch size: one item
+    SELECT, one bulk INSERT of events and one bulk UPDATE of items.
+    """
+    reviewed_at = reviewed_at or timezone.now()
+    items = MemoryItem.objects.filter(
+        room__palace=palace, pk__in={item_id for item_id, *_ in reviews}
+    ).select_for_update().in_bulk()
+    
+    events = []
+    for item_id, grade, response_time, *when in reviews:
+        item = items.get(item_id)
+        if item is None:
+            if skip_missing:
+                continue
+            raise ValidationError(f"Unknown memory item {item_id}")
+        at = when[0] if when else reviewed_at
+        apply_review(item, grade, at)
+        events.append(ReviewEvent(
+            user=user, item=item, session=session, grade=grade,
+            response_time_ms=response_time, reviewed_at=at,
+        ))
+    
+    ReviewEvent.objects.bulk_create(events)
+    MemoryItem.objects.bulk_update(items.values(), SCHEDULING_FIELDS)
+    return list(items.values())
@@ -0,0 +1,363 @@
+"""
+Walk routes through a palace, planned from the rooms' coordinates.
+
+The route is an open path starting at the entrance (the first room by
+``order``): nearest-neighbour construction followed by 2-opt improvement.
+It is stored on ``Palace.walk_route`` together with the coordinates it was
+planned from and each room's nearest neighbours, so pages only read it.
+When rooms are added, moved, removed or reordered the stored route is
+patched on commit (removed rooms spliced out, new or moved ones put back by
+cheapest insertion) and a RouteJob is queued. The ``process_route_jobs``
+worker then re-polishes it with 2-opt, off the request path.
+
+NumPy (in requirements.txt) vectorises the inner loops; without it the same
+algorithms run in pure Python, with 2-opt stopped after a time budget on
+very large palaces.
+"""
+import heapq
+import logging
+import math
+import time
+from datetime import timedelta
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Palace, RouteJob
+
+logger = logging.getLogger(__name__)
+
+NEARBY_COUNT = 3
+MAX_TWO_OPT_PASSES = 50
+# Pure-Python 2-opt is O(n^2) per pass in the interpreter, so it keeps the
+# best route found within this many seconds
+PURE_PYTHON_TWO_OPT_SECONDS = 2.0
+EPSILON = 1e-9
+# Rooms placed by cheapest insertion when a route is patched on commit; any
+# beyond this are appended and left for the worker to place
+MAX_INLINE_INSERTS = 50
+
+MAX_ATTEMPTS = 3
+STALE_JOB_AFTER = timedelta(minutes=10)
+
+
+def _distances(points):
+    """Pairwise distance matrix plus a trailing dummy node at distance 0 from everything
+    
+    The dummy lets the open path be treated as a tour ending at the dummy,
+    so the last edge needs no special case.
+    """
+    if np is not None:
+        coords = np.array(points, dtype=float).reshape(-1, 2)
+        matrix = np.zeros((len(points) + 1, len(points) + 1))
+        matrix[:-1, :-1] = np.hypot(*(coords[:, None, :] - coords[None, :, :]).transpose(2, 0, 1))
+        return matrix
+    size = len(points) + 1
+    matrix = [[0.0] * size for _ in range(size)]
+    for i, (x1, y1) in enumerate(points):
+        for j, (x2, y2) in enumerate(points):
+            matrix[i][j] = math.hypot(x1 - x2, y1 - y2)
+    return matrix
+
+
+def _nearest_neighbour(dist, count, start=0):
+    route = [start]
+    if np is not None:
+        unvisited = np.ones(count, dtype=bool)
+        unvisited[start] = False
+        for _ in range(count - 1):
+            row = np.where(unvisited, dist[route[-1], :count], np.inf)
+            nearest = int(row.argmin())
+            unvisited[nearest] = False
+            route.append(nearest)
+        return route
+    unvisited = set(range(count)) - {start}
+    while unvisited:
+        nearest = min(unvisited, key=lambda j: dist[route[-1]][j])
+        unvisited.remove(nearest)
+        route.append(nearest)
+    return route
+
+
+def _cheapest_insertion(dist, route, node):
+    """Insert ``node`` where it lengthens the path least (never before the start)"""
+    padded = route + [len(dist) - 1]
+    if np is not None:
+        a, b = np.array(padded[:-1]), np.array(padded[1:])
+        costs = dist[a, node] + dist[node, b] - dist[a, b]
+        position = int(costs.argmin())
+    else:
+        position = min(
+            range(len(route)),
+            key=lambda p: dist[padded[p]][node] + dist[node][padded[p + 1]] - dist[padded[p]][padded[p + 1]],
+        )
+    route.insert(position + 1, node)
+
+
+def _two_opt(dist, route):
+    """Reverse segments while that shortens the path; the start stays fixed"""
+    count = len(route)
+    if count < 4:
+        return route
+    dummy = len(dist) - 1
+    deadline = time.monotonic() + PURE_PYTHON_TWO_OPT_SECONDS if np is None else None
+    
+    for _ in range(MAX_TWO_OPT_PASSES):
+        improved = False
+        for i in range(1, count - 1):
+            if deadline is not None and time.monotonic() > deadline:
+                return route
+            padded = route + [dummy]
+            a, b = padded[i - 1], padded[i]
+            if np is not None:
+                c = np.array(padded[i + 1:count])
+                e = np.array(padded[i + 2:count + 1])
+                deltas = dist[a, c] + dist[b, e] - dist[a, b] - dist[c, e]
+                best = int(deltas.argmin())
+                delta = deltas[best]
+            else:
+                delta, best = min(
+                    (dist[a][padded[j]] + dist[b][padded[j + 1]] - dist[a][b] - dist[padded[j]][padded[j + 1]], j - i - 1)
+                    for j in range(i + 1, count)
+                )
+            if delta < -EPSILON:
+                j = i + 1 + best
+                route[i:j + 1] = reversed(route[i:j + 1])
+                improved = True
+        if not improved:
+            break
+    return route
+
+
+def _length(dist, route):
+    if np is not None:
+        return float(dist[route[:-1], route[1:]].sum()) if len(route) > 1 else 0.0
+    return sum(dist[a][b] for a, b in zip(route, route[1:]))
+
+
+def _nearby(dist, count):
+    k = min(NEARBY_COUNT, count - 1)
+    if k <= 0:
+        return [[] for _ in range(count)]
+    if np is not None:
+        matrix = dist[:count, :count] + np.diag(np.full(count, np.inf))
+        nearest = np.argpartition(matrix, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(matrix, nearest, axis=1).argsort(axis=1)
+        return np.take_along_axis(nearest, order, axis=1).tolist()
+    return [sorted((j for j in range(count) if j != i), key=lambda j: dist[i][j])[:k] for i in range(count)]
+
+
+def plan_route(rooms, previous=None):
+    """Plan a walk through ``rooms``, a list of ``(id, x, y)`` in entrance-first order
+    
+    ``previous`` is a stored route to repair rather than replace. Returns the
+    value stored in ``Palace.walk_route``.
+    """
+    if not rooms:
+        return {}
+    ids = [str(pk) for pk, _, _ in rooms]
+    points = [(x, y) for _, x, y in rooms]
+    index = {pk: i for i, pk in enumerate(ids)}
+    dist = _distances(points)
+    
+    previous = previous or {}
+    old_points = previous.get('points', {})
+    unplaced = set(previous.get('unplaced', []))
+    kept = [
+        index[pk] for pk in previous.get('rooms', [])
+        if pk in index and pk not in unplaced and old_points.get(pk) == list(points[index[pk]])
+    ]
+    if kept:
+        # Repair: keep unchanged rooms in their old order after the
+        # entrance, then insert the rest
+        route = [0] + [node for node in kept if node != 0]
+        for node in set(range(len(ids))) - set(route):
+            _cheapest_insertion(dist, route, node)
+    else:
+        route = _nearest_neighbour(dist, len(ids))
+    route = _two_opt(dist, route)
+    
+    nearby = _nearby(dist, len(ids))
+    return {
+        'start': ids[0],
+        'rooms': [ids[i] for i in route],
+        'points': {pk: list(point) for pk, point in zip(ids, points)},
+        'nearby': {ids[i]: [ids[j] for j in neighbours] for i, neighbours in enumerate(nearby)},
+        'length': round(_length(dist, route), 3),
+        'polished': True,
+    }
+
+
+def _distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def _insert_point(route, points, pk):
+    """Cheapest insertion of ``pk`` into a route of ids, without a distance matrix"""
+    point = points[pk]
+    best, position = _distance(points[route[-1]], point), len(route)
+    for i in range(1, len(route)):
+        a, b = points[route[i - 1]], points[route[i]]
+        cost = _distance(a, point) + _distance(point, b) - _distance(a, b)
+        if cost < best:
+            best, position = cost, i
+    route.insert(position, pk)
+
+
+def repair_route(rooms, previous=None):
+    """Patch ``previous`` for ``rooms`` cheaply enough to run on commit
+    
+    Unchanged rooms keep their old order after the entrance and at most
+    MAX_INLINE_INSERTS new or moved rooms are inserted, each in O(n). The
+    result is marked unpolished so the route worker re-plans it.
+    """
+    if not rooms:
+        return {}
+    ids = [str(pk) for pk, _, _ in rooms]
+    points = {pk: (x, y) for pk, (_, x, y) in zip(ids, rooms)}
+    previous = previous or {}
+    old_points = previous.get('points', {})
+    unplaced = set(previous.get('unplaced', []))
+    
+    route = [ids[0]] + [
+        pk for pk in previous.get('rooms', [])
+        if pk != ids[0] and pk in points and pk not in unplaced and old_points.get(pk) == list(points[pk])
+    ]
+    placed = set(route)
+    missing = [pk for pk in ids if pk not in placed]
+    inserted, unplaced = missing[:MAX_INLINE_INSERTS], missing[MAX_INLINE_INSERTS:]
+    for pk in inserted:
+        _insert_point(route, points, pk)
+    route += unplaced
+    
+    k = min(NEARBY_COUNT, len(ids) - 1)
+    nearby = {
+        pk: [other for other in neighbours if other in points]
+        for pk, neighbours in previous.get('nearby', {}).items() if pk in placed
+    }
+    moved_entrance = [ids[0]] if old_points.get(ids[0]) != list(points[ids[0]]) else []
+    for pk in moved_entrance + inserted:
+        nearby[pk] = heapq.nsmallest(
+            k, (other for other in ids if other != pk), key=lambda other: _distance(points[pk], points[other])
+        )
+    return {
+        'start': ids[0],
+        'rooms': route,
+        'points': {pk: list(point) for pk, point in points.items()},
+        'nearby': nearby,
+        'length': round(sum(_distance(points[a], points[b]) for a, b in zip(route, route[1:])), 3),
+        'polished': False,
+        'unplaced': unplaced,
+    }
+
+
+def _up_to_date(walk_route, rooms, polished=True):
+    """Whether ``walk_route`` was planned from exactly these rooms and entrance
+    
+    With ``polished`` an inline patch from repair_route() does not count.
+    """
+    if not rooms:
+        return not walk_route
+    return (
+        (walk_route.get('polished', False) or not polished)
+        and walk_route.get('start') == str(rooms[0][0])
+        and walk_route.get('points') == {str(pk): [x, y] for pk, x, y in rooms}
+    )
+
+
+def refresh_routes(palace_ids, full=False):
+    """Re-plan the stored routes of palaces whose rooms were added, moved, removed or reordered
+
+    With ``full`` every route is planned from scratch. Returns how many
+    routes changed.
+    """
+    changed = 0
+    palaces = Palace.objects.filter(pk__in=palace_ids).only('pk', 'walk_route')
+    for palace in palaces.iterator():
+        rooms = list(palace.rooms.order_by('order', 'name').values_list('pk', 'x_coordinate', 'y_coordinate'))
+        if not full and _up_to_date(palace.walk_route, rooms):
+            continue
+        route = plan_route(rooms, previous=None if full else palace.walk_route)
+        Palace.objects.filter(pk=palace.pk).update(walk_route=route)
+        changed += 1
+    return changed
+
+
+def repair_routes(palace_ids):
+    """Patch the stored routes of palaces whose rooms changed and queue them for the worker"""
+    queued = []
+    palaces = Palace.objects.filter(pk__in=palace_ids).only('pk', 'walk_route')
+    for palace in palaces.iterator():
+        rooms = list(palace.rooms.order_by('order', 'name').values_list('pk', 'x_coordinate', 'y_coordinate'))
+        if _up_to_date(palace.walk_route, rooms):
+            continue
+        if not _up_to_date(palace.walk_route, rooms, polished=False):
+            Palace.objects.filter(pk=palace.pk).update(walk_route=repair_route(rooms, palace.walk_route))
+        if rooms:
+            queued.append(palace.pk)
+    enqueue(queued)
+    return queued
+
+
+def enqueue(palace_ids):
+    """Queue route re-plans; a palace already queued or running goes back to pending"""
+    if not palace_ids:
+        return
+    RouteJob.objects.bulk_create(
+        [RouteJob(palace_id=pk) for pk in palace_ids],
+        update_conflicts=True, unique_fields=['palace'], update_fields=['status', 'attempts', 'error', 'updated_at'],
+    )
+
+
+def claim_jobs(limit):
+    """Atomically move up to ``limit`` pending jobs to running and return them"""
+    now = timezone.now()
+    
+    # Jobs left running by a crashed worker go back in the queue
+    RouteJob.objects.filter(status=RouteJob.RUNNING, updated_at__lt=now - STALE_JOB_AFTER).update(
+        status=RouteJob.PENDING
+    )
+    
+    candidates = RouteJob.objects.filter(status=RouteJob.PENDING).order_by('created_at')
+    claimed = []
+    for pk in candidates.values_list('pk', flat=True)[:limit]:
+        won = RouteJob.objects.filter(pk=pk, status=RouteJob.PENDING).update(
+            status=RouteJob.RUNNING, attempts=F('attempts') + 1, updated_at=now
+        )
+        if won:
+            claimed.append(pk)
+    return list(RouteJob.objects.filter(pk__in=claimed))
+
+
+def process_job(job):
+    """Re-plan one palace's route; finished jobs are deleted, failed ones retried"""
+    from .signals import schedule_palace_refresh
+    
+    try:
+        if refresh_routes([job.palace_id]):
+            schedule_palace_refresh(palace_ids=[job.palace_id])
+    except Exception as e:
+        logger.exception("Route job %s failed", job.pk)
+        job.status = RouteJob.FAILED if job.attempts >= MAX_ATTEMPTS else RouteJob.PENDING
+        job.error = str(e)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        return False
+    
+    # A job set back to pending while this one ran has newer rooms to plan
+    RouteJob.objects.filter(pk=job.pk, status=RouteJob.RUNNING).delete()
+    return True
+
+
+def rooms_in_route(palace, rooms):
+    """``rooms`` sorted by the palace's walk route, unrouted rooms last"""
+    position = {pk: i for i, pk in enumerate(palace.walk_route.get('rooms', []))}
+    return sorted(rooms, key=lambda room: position.get(str(room.pk), len(position)))
+
+
+def nearby_room_ids(palace, room):
+    return palace.walk_route.get('nearby', {}).get(str(room.pk), [])
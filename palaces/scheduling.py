@@ -0,0 +1,53 @@
+"""
+SM-2 spaced repetition scheduling for memory items.
+
+Grades follow the original SuperMemo scale: 0-2 is a failed recall,
+3 is correct with difficulty, 4 correct after hesitation, 5 perfect.
+"""
+from datetime import timedelta
+
+from django.utils import timezone
+
+MIN_EASE = 1.3
+DEFAULT_EASE = 2.5
+PASSING_GRADE = 3
+MAX_GRADE = 5
+
+# An item whose interval reaches this many days counts as mastered
+MASTERED_INTERVAL_DAYS = 21
+
+
+def sm2(ease, interval, repetitions, grade):
+    """Return the next (ease, interval_days, repetitions) for a review grade"""
+    grade = max(0, min(MAX_GRADE, int(grade)))
+    
+    if grade < PASSING_GRADE:
+        repetitions = 0
+        interval = 1
+    else:
+        if repetitions == 0:
+            interval = 1
+        elif repetitions == 1:
+            interval = 6
+        else:
+            interval = round(interval * ease)
+        repetitions += 1
+    
+    ease = ease + (0.1 - (MAX_GRADE - grade) * (0.08 + (MAX_GRADE - grade) * 0.02))
+    return max(MIN_EASE, ease), interval, repetitions
+
+
+def apply_review(item, grade, reviewed_at=None):
+    """Update an item's scheduling fields in place (does not save)"""
+    reviewed_at = reviewed_at or timezone.now()
+    item.ease_factor, item.interval_days, item.repetitions = sm2(
+        item.ease_factor, item.interval_days, item.repetitions, grade
+    )
+    item.last_reviewed = reviewed_at
+    item.next_due = reviewed_at + timedelta(days=item.interval_days)
+    item.is_mastered = item.interval_days >= MASTERED_INTERVAL_DAYS
+    return item
+
+
+# Fields written by apply_review, for save(update_fields=...) and bulk_update
+SCHEDULING_FIELDS = ['ease_factor', 'interval_days', 'repetitions', 'last_reviewed', 'next_due', 'is_mastered']
@@ -0,0 +1,278 @@
+"""
+Full-text search over a user's memory items.
+
+The default backend keeps an SQLite FTS5 index in sync with MemoryItem,
+Room and Palace writes (see palaces.signals). On PostgreSQL the
+``PostgresSearchBackend`` queries tsvectors instead. Pick a backend with
+the ``PALACE_SEARCH_BACKEND`` setting (a dotted path); by default it is
+chosen from the database vendor.
+"""
+import re
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+from django.utils.safestring import mark_safe
+
+from .models import Palace, Room, MemoryItem
+
+# Control characters used as highlight markers so user content can be
+# HTML-escaped before the <mark> tags are added
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+
+def highlight(text):
+    """Escape a snippet and turn the backend's markers into <mark> tags"""
+    return mark_safe(escape(text).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+class SearchBackend:
+    """Interface every search backend implements; index hooks default to no-ops"""
+    
+    def setup(self):
+        pass
+    
+    def index_items(self, item_ids):
+        pass
+    
+    def remove_items(self, item_ids):
+        pass
+    
+    def index_palace(self, palace_id):
+        pass
+    
+    def update_room(self, room):
+        pass
+    
+    def update_palace(self, palace):
+        pass
+    
+    def update_owner(self, palace_ids, owner_id):
+        pass
+    
+    def remove_room(self, room_id):
+        pass
+    
+    def rebuild(self):
+        pass
+    
+    def search(self, user, query, limit=50):
+        """Return a ranked list of result dicts for ``user``'s palaces"""
+        raise NotImplementedError
+
+
+class SQLiteFTS5Backend(SearchBackend):
+    """FTS5 index over an external-content document table
+
+    ``palaces_search_doc`` holds one row per item with B-tree indexes on
+    the ids, so every sync is an indexed write; triggers mirror it into
+    the ``palaces_search`` FTS5 table.
+    """
+    table = 'palaces_search'
+    doc_table = 'palaces_search_doc'
+    columns = ['content', 'mnemonic_hint', 'room_name', 'palace_name']
+    # bm25() weights, in the same order as ``columns``
+    weights = (10.0, 5.0, 2.0, 1.0)
+    
+    def setup(self):
+        columns = ', '.join(self.columns)
+        new_values = ', '.join(f'new.{column}' for column in self.columns)
+        old_values = ', '.join(f'old.{column}' for column in self.columns)
+        delete_old = (
+            f"INSERT INTO {self.table}({self.table}, rowid, {columns}) VALUES ('delete', old.rowid, {old_values});"
+        )
+        insert_new = f'INSERT INTO {self.table}(rowid, {columns}) VALUES (new.rowid, {new_values});'
+        statements = [
+            f'CREATE TABLE IF NOT EXISTS {self.doc_table} ('
+            'rowid INTEGER PRIMARY KEY, item_id TEXT NOT NULL UNIQUE, room_id TEXT NOT NULL, '
+            'palace_id TEXT NOT NULL, owner_id INTEGER NOT NULL, '
+            'content TEXT, mnemonic_hint TEXT, room_name TEXT, palace_name TEXT)',
+            f'CREATE INDEX IF NOT EXISTS {self.doc_table}_room ON {self.doc_table}(room_id)',
+            f'CREATE INDEX IF NOT EXISTS {self.doc_table}_palace ON {self.doc_table}(palace_id)',
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5({columns}, '
+            f"content='{self.doc_table}', content_rowid='rowid', tokenize='porter unicode61')",
+            f'CREATE TRIGGER IF NOT EXISTS {self.doc_table}_ai AFTER INSERT ON {self.doc_table} '
+            f'BEGIN {insert_new} END',
+            f'CREATE TRIGGER IF NOT EXISTS {self.doc_table}_ad AFTER DELETE ON {self.doc_table} '
+            f'BEGIN {delete_old} END',
+            f'CREATE TRIGGER IF NOT EXISTS {self.doc_table}_au AFTER UPDATE ON {self.doc_table} '
+            f'BEGIN {delete_old} {insert_new} END',
+        ]
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    
+    def _insert_sql(self):
+        return (
+            f'INSERT INTO {self.doc_table} '
+            f'(item_id, room_id, palace_id, owner_id, content, mnemonic_hint, room_name, palace_name) '
+            f'SELECT i.id, i.room_id, r.palace_id, p.owner_id, i.content, i.mnemonic_hint, r.name, p.name '
+            f'FROM {MemoryItem._meta.db_table} i '
+            f'INNER JOIN {Room._meta.db_table} r ON r.id = i.room_id '
+            f'INNER JOIN {Palace._meta.db_table} p ON p.id = r.palace_id'
+        )
+    
+    def _batches(self, pks, size=500):
+        pks = [MemoryItem._meta.pk.get_db_prep_value(pk, connection) for pk in pks]
+        for start in range(0, len(pks), size):
+            batch = pks[start:start + size]
+            yield batch, ', '.join(['%s'] * len(batch))
+    
+    def index_items(self, item_ids):
+        with connection.cursor() as cursor:
+            for batch, placeholders in self._batches(item_ids):
+                cursor.execute(f'DELETE FROM {self.doc_table} WHERE item_id IN ({placeholders})', batch)
+                cursor.execute(f'{self._insert_sql()} WHERE i.id IN ({placeholders})', batch)
+    
+    def remove_items(self, item_ids):
+        with connection.cursor() as cursor:
+            for batch, placeholders in self._batches(item_ids):
+                cursor.execute(f'DELETE FROM {self.doc_table} WHERE item_id IN ({placeholders})', batch)
+    
+    def index_palace(self, palace_id):
+        """Re-copy every item of a palace"""
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.doc_table} WHERE palace_id = %s', [palace_id.hex])
+            cursor.execute(f'{self._insert_sql()} WHERE r.palace_id = %s', [palace_id.hex])
+    
+    def update_room(self, room):
+        """Re-copy a room's items, picking up a rename or a move to another palace"""
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.doc_table} WHERE room_id = %s', [room.pk.hex])
+            cursor.execute(f'{self._insert_sql()} WHERE i.room_id = %s', [room.pk.hex])
+    
+    def update_palace(self, palace):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {self.doc_table} SET palace_name = %s, owner_id = %s '
+                f'WHERE palace_id = %s AND (palace_name != %s OR owner_id != %s)',
+                [palace.name, palace.owner_id, palace.pk.hex, palace.name, palace.owner_id],
+            )
+    
+    def update_owner(self, palace_ids, owner_id):
+        with connection.cursor() as cursor:
+            for batch, placeholders in self._batches(palace_ids):
+                cursor.execute(
+                    f'UPDATE {self.doc_table} SET owner_id = %s WHERE palace_id IN ({placeholders})',
+                    [owner_id, *batch],
+                )
+    
+    def remove_room(self, room_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.doc_table} WHERE room_id = %s', [room_id.hex])
+    
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+            cursor.execute(f'DROP TABLE IF EXISTS {self.doc_table}')
+        self.setup()
+        with connection.cursor() as cursor:
+            cursor.execute(self._insert_sql())
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')")
+    
+    def match_expression(self, query):
+        """Quote each word as a prefix term so user input can't break FTS5 syntax"""
+        words = re.findall(r'\w+', query)
+        return ' '.join(f'"{word}"*' for word in words)
+    
+    def search(self, user, query, limit=50):
+        match = self.match_expression(query)
+        if not match:
+            return []
+        weights = ', '.join(str(weight) for weight in self.weights)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT d.item_id, d.room_id, d.palace_id, d.room_name, d.palace_name, '
+                f"snippet({self.table}, 0, %s, %s, '…', 24), "
+                f"snippet({self.table}, 1, %s, %s, '…', 16), "
+                f'bm25({self.table}, {weights}) AS rank '
+                f'FROM {self.table} INNER JOIN {self.doc_table} d ON d.rowid = {self.table}.rowid '
+                f'WHERE {self.table} MATCH %s AND d.owner_id = %s '
+                f'ORDER BY rank LIMIT %s',
+                [MARK_START, MARK_END, MARK_START, MARK_END, match, user.pk, limit],
+            )
+            rows = cursor.fetchall()
+        return [
+            {
+                'item_id': uuid.UUID(item_id),
+                'room_id': uuid.UUID(room_id),
+                'palace_id': uuid.UUID(palace_id),
+                'room_name': room_name,
+                'palace_name': palace_name,
+                'content': highlight(content),
+                'mnemonic_hint': highlight(hint),
+                'rank': -rank,
+            }
+            for item_id, room_id, palace_id, room_name, palace_name, content, hint, rank in rows
+        ]
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Ranks with tsvectors computed in the query
+
+    For large tables add a GIN index on the same weighted expression so
+    PostgreSQL can serve the match from the index.
+    """
+    
+    def search(self, user, query, limit=50):
+        from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+        
+        search_query = SearchQuery(query, search_type='websearch')
+        vector = (
+            SearchVector('content', weight='A') + SearchVector('mnemonic_hint', weight='B')
+            + SearchVector('room__name', weight='C') + SearchVector('room__palace__name', weight='D')
+        )
+        headline = {'start_sel': MARK_START, 'stop_sel': MARK_END}
+        items = (
+            MemoryItem.objects.filter(room__palace__owner=user)
+            .annotate(
+                rank=SearchRank(vector, search_query),
+                content_headline=SearchHeadline('content', search_query, **headline),
+                hint_headline=SearchHeadline('mnemonic_hint', search_query, **headline),
+            )
+            .filter(rank__gt=0)
+            .order_by('-rank')
+            .values('pk', 'room_id', 'room__palace_id', 'room__name', 'room__palace__name',
+                    'content_headline', 'hint_headline', 'rank')[:limit]
+        )
+        return [
+            {
+                'item_id': item['pk'],
+                'room_id': item['room_id'],
+                'palace_id': item['room__palace_id'],
+                'room_name': item['room__name'],
+                'palace_name': item['room__palace__name'],
+                'content': highlight(item['content_headline']),
+                'mnemonic_hint': highlight(item['hint_headline']),
+                'rank': item['rank'],
+            }
+            for item in items
+        ]
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTS5Backend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'PALACE_SEARCH_BACKEND', None)
+        if path:
+            backend_class = import_string(path)
+        elif connection.vendor in BACKENDS:
+            backend_class = BACKENDS[connection.vendor]
+        else:
+            raise ImproperlyConfigured(
+                f"No search backend for the '{connection.vendor}' database; set PALACE_SEARCH_BACKEND"
+            )
+        _backend = backend_class()
+    return _backend
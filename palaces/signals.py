@@ -0,0 +1,222 @@
+import threading
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache, images, routing
+from .search import get_backend
+from .models import Palace, Room, MemoryItem, Tombstone, ROUTE_FIELDS, SEARCH_FIELDS
+
+_pending = threading.local()
+# Users, palaces and rooms being deleted, so their cascaded children get no tombstone
+_deleting = threading.local()
+
+
+def _pk(value):
+    return getattr(value, 'pk', value)
+
+
+def schedule_palace_refresh(palace_ids=(), room_ids=(), owner_ids=(), reroute_ids=()):
+    """Queue counter refreshes and cache invalidation until the transaction commits
+
+    Work is batched per transaction, so cascading deletes and bulk writes
+    cost one UPDATE instead of one per row. ``owner_ids`` names users whose
+    palace list changed even if the palace itself is gone; ``reroute_ids``
+    names palaces whose rooms were added, moved or removed.
+    """
+    palace_ids = {_pk(pk) for pk in palace_ids if pk is not None}
+    room_ids = {_pk(pk) for pk in room_ids if pk is not None}
+    owner_ids = {_pk(pk) for pk in owner_ids if pk is not None}
+    reroute_ids = {_pk(pk) for pk in reroute_ids if pk is not None}
+    if not palace_ids and not room_ids and not owner_ids and not reroute_ids:
+        return
+    
+    state = getattr(_pending, 'state', None) or {
+        'palace_ids': set(), 'room_ids': set(), 'owner_ids': set(), 'reroute_ids': set(),
+    }
+    state['palace_ids'] |= palace_ids | reroute_ids
+    state['room_ids'] |= room_ids
+    state['owner_ids'] |= owner_ids
+    state['reroute_ids'] |= reroute_ids
+    _pending.state = state
+    
+    # Ids left over from a rolled back transaction stay queued; refreshing an
+    # unchanged palace is harmless.
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block or not any(
+        entry[1] is _flush_palace_refresh for entry in connection.run_on_commit
+    ):
+        transaction.on_commit(_flush_palace_refresh)
+
+
+def _flush_palace_refresh():
+    state = getattr(_pending, 'state', None)
+    _pending.state = None
+    _deleting.ids = set()
+    if not state:
+        return
+    
+    palaces = dict(
+        Palace.objects.filter(Q(pk__in=state['palace_ids']) | Q(rooms__pk__in=state['room_ids']))
+        .values_list('pk', 'owner_id').distinct()
+    )
+    if palaces:
+        Palace.objects.filter(pk__in=palaces).refresh_counters()
+    if state['reroute_ids']:
+        # Only the cheap patch runs here; the route worker re-plans
+        routing.repair_routes(state['reroute_ids'])
+    cache.bump_palaces(
+        palace_ids=state['palace_ids'] | set(palaces),
+        owner_ids=state['owner_ids'] | set(palaces.values()),
+    )
+
+
+@receiver(post_save, sender=Palace)
+def palace_saved(sender, instance, **kwargs):
+    schedule_palace_refresh(palace_ids=[instance.pk], owner_ids=[instance.owner_id])
+
+
+@receiver(post_delete, sender=Palace)
+def palace_deleted(sender, instance, **kwargs):
+    schedule_palace_refresh(palace_ids=[instance.pk], owner_ids=[instance.owner_id])
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def room_changed(sender, instance, update_fields=None, **kwargs):
+    moved = update_fields is None or ROUTE_FIELDS.intersection(update_fields)
+    schedule_palace_refresh(palace_ids=[instance.palace_id], reroute_ids=[instance.palace_id] if moved else ())
+
+
+@receiver(post_save, sender=Room)
+def room_moved(sender, instance, created, update_fields=None, **kwargs):
+    # MemoryItem.palace follows the room to another palace
+    if not created and (update_fields is None or {'palace', 'palace_id'}.intersection(update_fields)):
+        MemoryItem.objects.filter(room=instance).exclude(palace=instance.palace_id).copy_room_palace()
+
+
+@receiver(post_save, sender=MemoryItem)
+@receiver(post_delete, sender=MemoryItem)
+def memory_item_changed(sender, instance, **kwargs):
+    schedule_palace_refresh(room_ids=[instance.room_id])
+
+
+@receiver(pre_save, sender=Palace)
+@receiver(pre_save, sender=Room)
+@receiver(pre_save, sender=MemoryItem)
+def note_image_upload(sender, instance, **kwargs):
+    # A new upload is stored when the field's pre_save runs, after this
+    if instance.image and not instance.image._committed:
+        instance._replaced_image = '' if instance._state.adding else (
+            sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first() or ''
+        )
+
+
+@receiver(post_save, sender=Palace)
+@receiver(post_save, sender=Room)
+@receiver(post_save, sender=MemoryItem)
+def count_image_blobs(sender, instance, **kwargs):
+    replaced = instance.__dict__.pop('_replaced_image', None)
+    if replaced is not None and replaced != instance.image.name:
+        images.acquire_blob(instance.image.name)
+        images.release_blob(replaced)
+
+
+@receiver(post_delete, sender=Palace)
+@receiver(post_delete, sender=Room)
+@receiver(post_delete, sender=MemoryItem)
+def release_image_blob(sender, instance, **kwargs):
+    if instance.image:
+        images.release_blob(instance.image.name)
+
+
+@receiver(post_save, sender=Palace)
+@receiver(post_save, sender=Room)
+@receiver(post_save, sender=MemoryItem)
+def queue_image_processing(sender, instance, **kwargs):
+    if images.needs_processing(instance):
+        renditions = images.existing_renditions(instance.image.name)
+        if renditions is None:
+            images.enqueue(instance)
+        else:
+            # Content seen before: its renditions already exist
+            instance.image_renditions = renditions
+            sender.objects.filter(pk=instance.pk).update(image_renditions=renditions)
+    elif not instance.image and instance.image_renditions:
+        instance.image_renditions = {}
+        sender.objects.filter(pk=instance.pk).update(image_renditions={})
+
+
+@receiver(post_migrate)
+def create_search_index(sender, **kwargs):
+    if sender.name == 'palaces':
+        get_backend().setup()
+
+
+@receiver(post_save, sender=MemoryItem)
+def index_memory_item(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or SEARCH_FIELDS.intersection(update_fields):
+        get_backend().index_items([instance.pk])
+
+
+@receiver(post_delete, sender=MemoryItem)
+def unindex_memory_item(sender, instance, **kwargs):
+    get_backend().remove_items([instance.pk])
+
+
+@receiver(post_save, sender=Room)
+def index_room(sender, instance, created, **kwargs):
+    if not created:
+        get_backend().update_room(instance)
+
+
+@receiver(post_delete, sender=Room)
+def unindex_room(sender, instance, **kwargs):
+    get_backend().remove_room(instance.pk)
+
+
+@receiver(post_save, sender=Palace)
+def index_palace(sender, instance, created, **kwargs):
+    if not created:
+        get_backend().update_palace(instance)
+
+
+def _deleting_ids():
+    if not hasattr(_deleting, 'ids'):
+        _deleting.ids = set()
+    return _deleting.ids
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Palace)
+@receiver(pre_delete, sender=Room)
+def mark_deleting(sender, instance, **kwargs):
+    _deleting_ids().add(instance.pk)
+
+
+@receiver(post_delete, sender=Palace)
+def palace_tombstone(sender, instance, **kwargs):
+    if instance.owner_id in _deleting_ids():
+        return
+    Tombstone.objects.create(owner_id=instance.owner_id, kind=Tombstone.PALACE, object_id=instance.pk)
+
+
+@receiver(post_delete, sender=Room)
+def room_tombstone(sender, instance, **kwargs):
+    if instance.palace_id in _deleting_ids():
+        return
+    owner_id = Palace.objects.filter(pk=instance.palace_id).values_list('owner_id', flat=True).first()
+    if owner_id is not None:
+        Tombstone.objects.create(owner_id=owner_id, kind=Tombstone.ROOM, object_id=instance.pk)
+
+
+@receiver(post_delete, sender=MemoryItem)
+def item_tombstone(sender, instance, **kwargs):
+    if instance.room_id in _deleting_ids():
+        return
+    owner_id = Palace.objects.filter(rooms=instance.room_id).values_list('owner_id', flat=True).first()
+    if owner_id is not None:
+        Tombstone.objects.create(owner_id=owner_id, kind=Tombstone.ITEM, object_id=instance.pk)
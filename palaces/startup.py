@@ -0,0 +1,118 @@
+"""
+Cold-start profiling.
+
+Each run starts a fresh interpreter with ``-X importtime``, loads the WSGI or
+ASGI application the way a gunicorn worker does and sends it one request.
+The report covers what a newly started (or autoscaled) worker pays before it
+can serve traffic: the import time of every module, the time to load the
+application and the time to the first response. With ``--preload`` only the
+first response is paid per worker; the load happens once in the master.
+"""
+import json
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .benchmarks import allowed_host
+
+# Dependencies that should only be imported by the code paths that use them
+LAZY_MODULES = ['PIL']
+
+PROBE = r'''
+import json, os, sys, time
+started = time.perf_counter()
+entry, path, host, lazy = sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4].split(',')
+application = __import__(f'memory_palace.{entry}', fromlist=['application']).application
+loaded = time.perf_counter()
+eager = [name for name in lazy if name in sys.modules]
+if entry == 'wsgi':
+    from wsgiref.util import setup_testing_defaults
+    environ = {'PATH_INFO': path, 'HTTP_HOST': host}
+    setup_testing_defaults(environ)
+    statuses = []
+    b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+    status = int(statuses[0].split()[0])
+else:
+    import asyncio
+    messages = []
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+    async def send(message):
+        messages.append(message)
+    asyncio.run(application({
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', host.encode())], 'client': ('127.0.0.1', 0), 'server': (host, 80),
+    }, receive, send))
+    status = messages[0]['status']
+finished = time.perf_counter()
+print(json.dumps({
+    'status': status,
+    'load_ms': round((loaded - started) * 1000, 1),
+    'first_request_ms': round((finished - loaded) * 1000, 1),
+    'eager': eager,
+}))
+'''
+
+
+def parse_importtime(output):
+    """Rows of ``-X importtime`` output as dicts, in import order"""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules.append({
+            'module': name.strip(),
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+            'self_ms': int(own) / 1000,
+            'cumulative_ms': int(cumulative) / 1000,
+        })
+    return modules
+
+
+def by_package(modules):
+    """Total import time per top-level package, slowest first"""
+    totals = defaultdict(float)
+    for module in modules:
+        totals[module['module'].split('.')[0]] += module['self_ms']
+    return sorted(((name, round(ms, 1)) for name, ms in totals.items()), key=lambda entry: -entry[1])
+
+
+def probe(entry='asgi', path='/'):
+    """Start one interpreter, load the application and send it one request"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE, entry, path, allowed_host(), ','.join(LAZY_MODULES)],
+        capture_output=True, text=True, cwd=settings.BASE_DIR,
+    )
+    wall_ms = round((time.perf_counter() - started) * 1000, 1)
+    if result.returncode:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+        raise RuntimeError('\n'.join(errors[-20:]))
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['wall_ms'] = wall_ms
+    report['modules'] = parse_importtime(result.stderr)
+    return report
+
+
+def run(runs=3, entry='asgi', path='/'):
+    """Median timings over ``runs`` cold starts, with the module times of the fastest"""
+    reports = [probe(entry, path) for _ in range(runs)]
+    fastest = min(reports, key=lambda report: report['wall_ms'])
+    return {
+        'entry': entry,
+        'path': path,
+        'runs': runs,
+        'status': fastest['status'],
+        'load_ms': statistics.median(report['load_ms'] for report in reports),
+        'first_request_ms': statistics.median(report['first_request_ms'] for report in reports),
+        'wall_ms': statistics.median(report['wall_ms'] for report in reports),
+        'eager': fastest['eager'],
+        'module_count': len(fastest['modules']),
+        'modules': fastest['modules'],
+    }
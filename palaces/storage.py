@@ -0,0 +1,64 @@
+"""
+Content-addressed storage for uploaded images.
+
+Files are named by the SHA-256 of their content, ``blobs/<ab>/<sha256>.<ext>``,
+so an image uploaded again (the same stock photo on several rooms, a palace
+and its clones) is stored once: saving content that already exists only
+returns the existing name. Which rows use a blob is counted in ImageBlob
+(see palaces.images); ``gc_image_blobs`` deletes the files no row uses.
+Files stored before content addressing keep their names and are left alone.
+"""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, storages
+
+BLOB_PREFIX = 'blobs/'
+_BLOB_NAME = re.compile(r'^blobs/[0-9a-f]{2}/([0-9a-f]{64})(\.[a-z0-9]+)?$')
+# Spellings of the same format, so identical content gets one name
+EXTENSION_ALIASES = {'.jpeg': '.jpg', '.jpe': '.jpg', '.tif': '.tiff'}
+
+
+def content_hash(content):
+    hasher = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    content.seek(0)
+    return hasher.hexdigest()
+
+
+def blob_name(digest, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    extension = EXTENSION_ALIASES.get(extension, extension)
+    if not re.fullmatch(r'\.[a-z0-9]{1,10}', extension):
+        extension = ''
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest}{extension}'
+
+
+def digest_of(name):
+    """The SHA-256 a blob name encodes, or None for other files"""
+    match = _BLOB_NAME.match(name or '')
+    return match.group(1) if match else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        blob = blob_name(content_hash(content), name)
+        if self.exists(blob):
+            return blob
+        saved = super().save(blob, content, max_length)
+        if saved != blob:
+            # The same content was stored concurrently; keep the first copy
+            self.delete(saved)
+        return blob
+
+
+def image_storage():
+    return storages['images']
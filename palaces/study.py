@@ -0,0 +1,240 @@
+"""
+Write-behind study sessions.
+
+A session in progress lives only in the cache: its owner, palace, cursor
+and the answers given so far with their timings. Nothing is written to the
+database until the session completes (or the reaper finds it idle), when
+the StudySession row, its ReviewEvents and the rescheduled items are all
+written in one transaction. Sessions abandoned before the first answer
+never reach the database at all.
+
+Started sessions are numbered from a cache counter so ``reap`` can walk
+them without a key scan. The cache must be shared between processes (the
+file or redis backend) when running several workers or the reaper command.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import progress
+from .models import Palace, MemoryItem, StudySession
+from .reviews import record_reviews
+from .scheduling import apply_review, PASSING_GRADE
+
+STATE_KEY = 'study:state:{}'
+LOCK_KEY = 'study:lock:{}'
+SEQ_KEY = 'study:seq'
+SLOT_KEY = 'study:slot:{}'
+REAPED_KEY = 'study:reaped'
+# Idle sessions stay in the cache this long past the idle timeout, for the reaper to find
+GRACE = timedelta(days=1)
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 5
+REAP_BATCH_SIZE = 200
+
+
+class SessionBusy(Exception):
+    """Another request holds the session's lock"""
+
+
+def get_cache():
+    return caches['study']
+
+
+def _idle_timeout():
+    return timedelta(minutes=settings.STUDY_SESSION_IDLE_MINUTES)
+
+
+def _state_timeout():
+    return int((_idle_timeout() + GRACE).total_seconds())
+
+
+@contextmanager
+def _lock(session_id):
+    cache = get_cache()
+    key = LOCK_KEY.format(session_id)
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(key, 1, timeout=LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            raise SessionBusy(session_id)
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+def _register(session_id):
+    cache = get_cache()
+    cache.add(SEQ_KEY, 0, timeout=None)
+    try:
+        number = cache.incr(SEQ_KEY)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.add(SEQ_KEY, 0, timeout=None)
+        number = cache.incr(SEQ_KEY)
+    cache.set(SLOT_KEY.format(number), session_id, timeout=None)
+
+
+def start(user, palace):
+    """Begin a session for ``user`` on ``palace``; returns its id"""
+    session_id = uuid.uuid4()
+    now = timezone.now()
+    get_cache().set(STATE_KEY.format(session_id), {
+        'id': session_id,
+        'user': user.pk,
+        'palace': palace.pk,
+        'started_at': now,
+        'touched_at': now,
+        'cursor': 0,
+        'reviews': [],
+    }, timeout=_state_timeout())
+    _register(session_id)
+    return session_id
+
+
+def load(session_id, user):
+    """The cached state of a session in progress, or None"""
+    state = get_cache().get(STATE_KEY.format(session_id))
+    if state is None or state['user'] != user.pk:
+        return None
+    return state
+
+
+def _totals(reviews):
+    return {
+        'reviewed': len(reviews),
+        'correct': sum(1 for _, grade, _, _ in reviews if grade >= PASSING_GRADE),
+    }
+
+
+def as_session(state):
+    """An unsaved StudySession showing the state's progress"""
+    session = StudySession(
+        id=state['id'], user_id=state['user'], palace_id=state['palace'], started_at=state['started_at'],
+    )
+    return session.set_totals(_totals(state['reviews']))
+
+
+def add_reviews(session_id, user, reviews, cursor=None):
+    """Append parsed reviews to a session in progress
+    
+    Returns ``(state, items)`` where ``items`` are the reviewed items with
+    every answer of the session applied (not saved), or None when the
+    session is not in progress. One read query; raises ValidationError for
+    items outside the palace.
+    """
+    cache = get_cache()
+    with _lock(session_id):
+        state = load(session_id, user)
+        if state is None:
+            return None
+        item_ids = {item_id for item_id, _, _ in reviews}
+        items = MemoryItem.objects.filter(room__palace=state['palace'], pk__in=item_ids).in_bulk()
+        missing = item_ids - set(items)
+        if missing:
+            raise ValidationError(f"Unknown memory item {missing.pop()}")
+        
+        now = timezone.now()
+        state['reviews'].extend([item_id, grade, response_time, now] for item_id, grade, response_time in reviews)
+        state['cursor'] = cursor if cursor is not None else state['cursor'] + len(reviews)
+        state['touched_at'] = now
+        cache.set(STATE_KEY.format(session_id), state, timeout=_state_timeout())
+    
+    for item_id, grade, _, reviewed_at in state['reviews']:
+        if item_id in items:
+            apply_review(items[item_id], grade, reviewed_at)
+    return state, list(items.values())
+
+
+@transaction.atomic
+def _flush(state):
+    existing = StudySession.objects.filter(pk=state['id']).first()
+    if existing is not None:
+        # Written before, but the cache entry outlived it
+        return existing
+    palace = Palace.objects.filter(pk=state['palace']).first()
+    if not state['reviews'] or palace is None:
+        return None
+    
+    session = as_session(state)
+    session.palace = palace
+    session.completed_at = state['touched_at']
+    session.save()
+    item_ids = {item_id for item_id, *_ in state['reviews']}
+    mastered_before = MemoryItem.objects.filter(room__palace=palace, pk__in=item_ids, is_mastered=True).count()
+    items = record_reviews(session.user, palace, state['reviews'], session=session, skip_missing=True)
+    # Reviews of items deleted mid-session were dropped and count nowhere
+    recorded = {item.pk for item in items}
+    progress.record_session(
+        session, [(reviewed_at, grade) for item_id, grade, _, reviewed_at in state['reviews'] if item_id in recorded],
+        mastered_change=sum(item.is_mastered for item in items) - mastered_before,
+    )
+    Palace.objects.filter(pk=palace.pk).update(study_count=F('study_count') + 1)
+    return session
+
+
+def finish(session_id, user=None):
+    """Write a session's answers to the database and end it
+    
+    Returns the saved StudySession, or None when the session had no answers
+    (or is not in progress) and was simply dropped.
+    """
+    cache = get_cache()
+    with _lock(session_id):
+        state = cache.get(STATE_KEY.format(session_id))
+        if state is None or (user is not None and state['user'] != user.pk):
+            return None
+        session = _flush(state)
+        cache.delete(STATE_KEY.format(session_id))
+    return session
+
+
+def reap():
+    """Finish sessions idle for longer than STUDY_SESSION_IDLE_MINUTES
+    
+    Returns ``(finished, dropped)`` counts.
+    """
+    cache = get_cache()
+    cutoff = timezone.now() - _idle_timeout()
+    low = cache.get(REAPED_KEY, 0)
+    high = cache.get(SEQ_KEY, 0)
+    if low > high:
+        # The counter was evicted and restarted
+        low = 0
+    
+    finished = dropped = 0
+    contiguous = True
+    for first in range(low + 1, high + 1, REAP_BATCH_SIZE):
+        numbers = range(first, min(first + REAP_BATCH_SIZE, high + 1))
+        slots = cache.get_many([SLOT_KEY.format(n) for n in numbers])
+        states = cache.get_many([STATE_KEY.format(pk) for pk in slots.values()])
+        for n in numbers:
+            session_id = slots.get(SLOT_KEY.format(n))
+            state = states.get(STATE_KEY.format(session_id)) if session_id else None
+            if state is not None and state['touched_at'] > cutoff:
+                contiguous = False
+                continue
+            if state is not None:
+                try:
+                    session = finish(session_id)
+                except SessionBusy:
+                    contiguous = False
+                    continue
+                if session is None:
+                    dropped += 1
+                else:
+                    finished += 1
+            cache.delete(SLOT_KEY.format(n))
+            if contiguous:
+                low = n
+    cache.set(REAPED_KEY, low, timeout=None)
+    return finished, dropped
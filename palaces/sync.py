@@ -0,0 +1,308 @@
+"""
+Delta sync for clients that keep a local copy of their palaces.
+
+``pull`` returns what changed since a client's cursor. It walks four
+streams in turn (palaces, rooms, items, then tombstones of deleted rows),
+each in ``(updated_at, id)`` order over an index, so a page costs the same
+however large the account is. A round only covers rows stamped before
+``until`` (a few seconds in the past, so transactions still in flight when
+the round started are picked up by the next one); when the last page is
+served the cursor collapses to ``[until]``, the ``since`` of the next round.
+
+``push`` applies a batch of offline edits in one transaction. Each change
+carries the ``updated_at`` the client last saw; if the server copy is newer
+the change is reported as a conflict, with the server's row, and skipped.
+"""
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .images import rendition_url
+from .models import Palace, Room, MemoryItem, Tombstone
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+
+SETTLE_TIME = timedelta(seconds=5)
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 2000
+MAX_PUSH_SIZE = 500
+
+PALACE_FIELDS = ['id', 'name', 'description', 'palace_type', 'is_public', 'updated_at']
+ROOM_FIELDS = ['id', 'palace_id', 'name', 'description', 'order', 'x_coordinate', 'y_coordinate', 'updated_at']
+ITEM_FIELDS = [
+    'id', 'room_id', 'content', 'item_type', 'mnemonic_hint', 'position_in_room', 'is_mastered',
+    'ease_factor', 'interval_days', 'repetitions', 'next_due', 'last_reviewed', 'updated_at',
+]
+TOMBSTONE_FIELDS = ['id', 'kind', 'object_id', 'deleted_at']
+
+# Fields a client may write, per change type
+PUSH_FIELDS = {
+    'palace': ['name', 'description', 'palace_type', 'is_public'],
+    'room': ['palace', 'name', 'description', 'order', 'x_coordinate', 'y_coordinate'],
+    'item': ['room', 'content', 'item_type', 'mnemonic_hint', 'position_in_room'],
+}
+# In dependency order
+MODELS = {'palace': Palace, 'room': Room, 'item': MemoryItem}
+PARENTS = {'palace': None, 'room': 'palace', 'item': 'room'}
+
+
+def _with_image(rows):
+    for row in rows:
+        row['image'] = rendition_url(row.pop('image'), row.pop('image_renditions'), 'card')
+        yield row
+
+
+# name -> (queryset for a user, time field, fields, post-processing)
+STREAMS = [
+    ('palaces', lambda user: Palace.objects.filter(owner=user), 'updated_at',
+     PALACE_FIELDS + ['image', 'image_renditions'], _with_image),
+    ('rooms', lambda user: Room.objects.filter(palace__owner=user), 'updated_at',
+     ROOM_FIELDS + ['image', 'image_renditions'], _with_image),
+    ('items', lambda user: MemoryItem.objects.filter(room__palace__owner=user), 'updated_at',
+     ITEM_FIELDS + ['image', 'image_renditions'], _with_image),
+    ('deleted', lambda user: Tombstone.objects.filter(owner=user), 'deleted_at',
+     TOMBSTONE_FIELDS, iter),
+]
+
+
+def _full_precision(row):
+    """Times as ISO strings with microseconds, which JSON encoding would cut to milliseconds
+    
+    Clients send ``updated_at`` back as the base of their edits, so it must
+    compare equal to the stored value.
+    """
+    return {field: value.isoformat() if isinstance(value, datetime) else value for field, value in row.items()}
+
+
+def _parse_time(value):
+    parsed = parse_datetime(value) if isinstance(value, str) and value else None
+    if parsed is None:
+        raise InvalidCursor(value)
+    return parsed
+
+
+def _decode(cursor):
+    """(since, until, stream, position, reset) for a cursor from a previous page"""
+    values = decode_cursor(cursor)
+    if len(values) == 1:
+        since = _parse_time(values[0])
+        if since < timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_DAYS):
+            # Tombstones this old are pruned: the client must start over
+            return None, timezone.now() - SETTLE_TIME, 0, None, True
+        return since, timezone.now() - SETTLE_TIME, 0, None, False
+    if len(values) != 5:
+        raise InvalidCursor(cursor)
+    since = _parse_time(values[0]) if values[0] else None
+    try:
+        stream = int(values[2])
+    except ValueError:
+        raise InvalidCursor(cursor)
+    if not 0 <= stream < len(STREAMS):
+        raise InvalidCursor(cursor)
+    position = (_parse_time(values[3]), values[4]) if values[3] else None
+    return since, _parse_time(values[1]), stream, position, False
+
+
+def pull(user, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of changes for ``user``; raises InvalidCursor for a malformed cursor"""
+    if cursor:
+        since, until, stream, position, reset = _decode(cursor)
+    else:
+        since, until, stream, position, reset = None, timezone.now() - SETTLE_TIME, 0, None, False
+    
+    page = {name: [] for name, *_ in STREAMS}
+    remaining = limit
+    while stream < len(STREAMS) and remaining > 0:
+        name, queryset, time_field, fields, process = STREAMS[stream]
+        if name == 'deleted' and since is None:
+            # A full download has nothing to delete
+            stream += 1
+            continue
+        
+        queryset = queryset(user).filter(**{f'{time_field}__lte': until})
+        if since is not None:
+            queryset = queryset.filter(**{f'{time_field}__gt': since})
+        if position is not None:
+            time, pk = position
+            queryset = queryset.filter(Q(**{f'{time_field}__gt': time}) | Q(**{time_field: time, 'pk__gt': pk}))
+        rows = list(process(queryset.order_by(time_field, 'pk').values(*fields)[:remaining]))
+        page[name].extend(_full_precision(row) for row in rows)
+        remaining -= len(rows)
+        if remaining > 0:
+            stream, position = stream + 1, None
+        else:
+            position = (rows[-1][time_field], rows[-1]['id'])
+    
+    if stream >= len(STREAMS):
+        next_cursor, has_more = encode_cursor([until]), False
+    else:
+        next_cursor = encode_cursor([
+            since.isoformat() if since else '', until, stream,
+            position[0].isoformat() if position else '', position[1] if position else '',
+        ])
+        has_more = True
+    return {**page, 'cursor': next_cursor, 'has_more': has_more, 'reset': reset}
+
+
+def parse_changes(payload):
+    """Validate a decoded JSON payload into a list of change dicts"""
+    changes = payload.get('changes') if isinstance(payload, dict) else None
+    if not isinstance(changes, list):
+        raise ValidationError("Expected a 'changes' list")
+    if len(changes) > MAX_PUSH_SIZE:
+        raise ValidationError(f"At most {MAX_PUSH_SIZE} changes per request")
+    
+    parsed = []
+    seen = set()
+    for index, change in enumerate(changes):
+        try:
+            kind = change['type']
+            op = change.get('op', 'upsert')
+            pk = uuid.UUID(str(change['id']))
+            base = change.get('base_updated_at')
+            base = parse_datetime(base) if base else None
+            fields = change.get('fields') or {}
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValidationError(f"Change {index} is malformed")
+        if kind not in MODELS or op not in ('upsert', 'delete') or not isinstance(fields, dict):
+            raise ValidationError(f"Change {index} is malformed")
+        unknown = set(fields) - set(PUSH_FIELDS[kind])
+        if unknown:
+            raise ValidationError(f"Change {index} writes unknown fields: {', '.join(sorted(unknown))}")
+        if base is not None and timezone.is_naive(base):
+            base = timezone.make_aware(base, dt_timezone.utc)
+        if pk in seen:
+            raise ValidationError(f"Change {index} repeats id {pk}")
+        seen.add(pk)
+        parsed.append({'type': kind, 'op': op, 'id': pk, 'base': base, 'fields': fields})
+    return parsed
+
+
+def _owned(kind, user):
+    return {
+        'palace': Palace.objects.filter(owner=user),
+        'room': Room.objects.filter(palace__owner=user),
+        'item': MemoryItem.objects.filter(room__palace__owner=user),
+    }[kind]
+
+
+def _serialize(kind, obj):
+    fields = {'palace': PALACE_FIELDS, 'room': ROOM_FIELDS, 'item': ITEM_FIELDS}[kind]
+    return _full_precision({field: getattr(obj, field) for field in fields})
+
+
+def _referenced(changes, field):
+    ids = set()
+    for change in changes:
+        try:
+            ids.add(uuid.UUID(str(change['fields'][field])))
+        except (KeyError, ValueError):
+            pass
+    return ids
+
+
+def _assign(obj, fields, parent_ids):
+    """Copy client fields onto ``obj``, resolving the parent id against what the user owns"""
+    for field, value in fields.items():
+        if field in ('palace', 'room'):
+            try:
+                parent_id = uuid.UUID(str(value))
+            except ValueError:
+                raise ValidationError(f"Invalid {field} id")
+            if parent_id not in parent_ids:
+                raise ValidationError(f"Unknown {field} {parent_id}")
+            setattr(obj, f'{field}_id', parent_id)
+        else:
+            setattr(obj, field, value)
+    obj.clean_fields(exclude=['id', 'owner', 'palace', 'room', 'image'])
+
+
+@transaction.atomic
+def push(user, changes):
+    """Apply ``changes`` for ``user``; returns one result dict per change
+    
+    Palaces are applied before rooms and rooms before items, so a batch can
+    create a room and its items together; deletes run last, children first.
+    Raises ValidationError for invalid field values and lets IntegrityError
+    (a clashing room order or item position) roll the whole batch back.
+    """
+    from .signals import schedule_palace_refresh
+    
+    results = {}
+    by_kind = {kind: [c for c in changes if c['type'] == kind] for kind in MODELS}
+    existing = {
+        kind: _owned(kind, user).select_for_update().in_bulk([c['id'] for c in by_kind[kind]])
+        for kind in MODELS
+    }
+    # Ids that exist but belong to someone else
+    foreign = {
+        kind: set(MODELS[kind].objects.filter(pk__in=[c['id'] for c in by_kind[kind]])
+                  .exclude(pk__in=list(existing[kind])).values_list('pk', flat=True))
+        for kind in MODELS
+    }
+    # Parents the batch refers to that the user owns; ones it creates are added below
+    owned_ids = {
+        parent: set(_owned(parent, user).filter(pk__in=_referenced(changes, parent)).values_list('pk', flat=True))
+        for parent in ('palace', 'room')
+    }
+    
+    deletes = {kind: [] for kind in MODELS}
+    for kind in MODELS:
+        parent_ids = owned_ids.get(PARENTS[kind], set())
+        created, updated, update_fields = [], [], set()
+        for change in by_kind[kind]:
+            obj = existing[kind].get(change['id'])
+            if change['id'] in foreign[kind]:
+                results[change['id']] = {'status': 'error', 'error': 'Not found'}
+                continue
+            if obj is not None and (change['base'] is None or obj.updated_at > change['base']):
+                results[change['id']] = {'status': 'conflict', 'current': _serialize(kind, obj)}
+                continue
+            results[change['id']] = {'status': 'applied'}
+            if change['op'] == 'delete':
+                if obj is not None:
+                    deletes[kind].append(obj.pk)
+                continue
+            
+            if obj is None:
+                if PARENTS[kind] and PARENTS[kind] not in change['fields']:
+                    raise ValidationError(f"{kind} {change['id']}: new rows need a {PARENTS[kind]}")
+                obj = MODELS[kind](id=change['id'])
+                if kind == 'palace':
+                    obj.owner = user
+                created.append(obj)
+            else:
+                updated.append(obj)
+                update_fields |= set(change['fields'])
+            try:
+                _assign(obj, change['fields'], parent_ids)
+            except ValidationError as e:
+                raise ValidationError(f"{kind} {change['id']}: {'; '.join(e.messages)}")
+        
+        if kind == 'palace':
+            # Few palaces per batch; save() keeps the palace signals
+            for obj in created + updated:
+                obj.save()
+        else:
+            MODELS[kind].objects.bulk_create(created)
+            if updated and update_fields:
+                MODELS[kind].objects.bulk_update(updated, list(update_fields))
+                # bulk_update only knows the old parents of moved rows
+                parents = {getattr(obj, f'{PARENTS[kind]}_id') for obj in updated}
+                if kind == 'room':
+                    schedule_palace_refresh(palace_ids=parents, reroute_ids=parents)
+                else:
+                    schedule_palace_refresh(room_ids=parents)
+        if kind in owned_ids:
+            owned_ids[kind] |= {obj.pk for obj in created}
+    
+    for kind in reversed(list(MODELS)):
+        if deletes[kind]:
+            MODELS[kind].objects.filter(pk__in=deletes[kind]).delete()
+    
+    return [{'type': c['type'], 'id': c['id'], **results[c['id']]} for c in changes]
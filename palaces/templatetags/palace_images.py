@@ -0,0 +1,14 @@
+from django import template
+
+from palaces.images import rendition_url
+
+register = template.Library()
+
+
+@register.filter
+def rendition(obj, name='card'):
+    """URL of an image rendition, falling back to the original upload
+
+    Usage: ``<img src="{{ palace|rendition:'card' }}">``
+    """
+    return rendition_url(obj.image.name if obj.image else '', obj.image_renditions, name)
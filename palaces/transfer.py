@@ -0,0 +1,206 @@
+"""
+Bulk import and streaming export of a palace's rooms and memory items.
+
+Import accepts CSV (``room,content,item_type,mnemonic_hint``), JSON (a list
+of such objects or a full palace export) and Anki-style TSV (``front<TAB>back``).
+Rows are validated and inserted in chunks with ``bulk_create``; the whole
+import runs in one transaction and is rolled back on the first bad row.
+"""
+import csv
+import io
+import json
+from itertools import groupby
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+
+from .models import Room, MemoryItem
+
+CHUNK_SIZE = 1000
+FORMATS = [
+    ('csv', 'CSV'),
+    ('json', 'JSON'),
+    ('tsv', 'Anki TSV'),
+]
+CSV_FIELDS = ['room', 'content', 'item_type', 'mnemonic_hint']
+
+ITEM_TYPES = {key for key, _ in MemoryItem.ITEM_TYPES}
+ROOM_NAME_MAX_LENGTH = Room._meta.get_field('name').max_length
+
+
+def read_rows(upload, fmt):
+    """Yield row dicts from an uploaded file without loading CSV/TSV into memory"""
+    if fmt == 'json':
+        try:
+            data = json.load(io.TextIOWrapper(upload, encoding='utf-8-sig'))
+        except (ValueError, UnicodeDecodeError):
+            raise ValidationError("The file is not valid JSON")
+        if isinstance(data, dict) and 'rooms' in data:
+            # Round-trip of export_json()
+            for room in data['rooms']:
+                for item in room.get('items', []):
+                    yield {**item, 'room': room.get('name')}
+        elif isinstance(data, list):
+            yield from data
+        else:
+            raise ValidationError("Expected a list of items or a palace export")
+        return
+    
+    text = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+    try:
+        if fmt == 'tsv':
+            for row in csv.reader(text, delimiter='\t'):
+                if not row or row[0].startswith('#'):
+                    continue
+                yield {'content': row[0], 'mnemonic_hint': row[1] if len(row) > 1 else ''}
+        else:
+            yield from csv.DictReader(text)
+    except UnicodeDecodeError:
+        raise ValidationError("The file is not UTF-8 encoded")
+
+
+def clean_row(row, line, default_room):
+    if not isinstance(row, dict):
+        raise ValidationError(f"Row {line}: expected an object")
+    content = str(row.get('content') or '').strip()
+    if not content:
+        raise ValidationError(f"Row {line}: content is required")
+    item_type = str(row.get('item_type') or 'text').strip()
+    if item_type not in ITEM_TYPES:
+        raise ValidationError(f"Row {line}: unknown item type '{item_type}'")
+    room = str(row.get('room') or default_room).strip()
+    if len(room) > ROOM_NAME_MAX_LENGTH:
+        raise ValidationError(f"Row {line}: room name is too long")
+    return room, content, item_type, str(row.get('mnemonic_hint') or '').strip()
+
+
+def chunked(iterable, size):
+    chunk = []
+    for value in iterable:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@transaction.atomic
+def import_items(palace, upload, fmt, default_room='Imported'):
+    """Import rows into ``palace``; returns (rooms_created, items_created)
+
+    Rooms are matched by name and created on demand at the end of the
+    palace's order. New items are appended after each room's highest
+    ``position_in_room`` so the unique constraints are never hit.
+    """
+    rooms = {room.name: room for room in palace.rooms.all()}
+    next_order = (palace.rooms.aggregate(n=Max('order'))['n'] or 0) + 1
+    next_position = dict(
+        MemoryItem.objects.filter(room__palace=palace).order_by()
+        .values_list('room_id').annotate(n=Max('position_in_room'))
+    )
+    rooms_created = items_created = 0
+    
+    rows = enumerate(read_rows(upload, fmt), start=1)
+    for chunk in chunked(rows, CHUNK_SIZE):
+        cleaned = [clean_row(row, line, default_room) for line, row in chunk]
+        
+        new_rooms = []
+        for name, *_ in cleaned:
+            if name not in rooms:
+                rooms[name] = Room(palace=palace, name=name, order=next_order)
+                new_rooms.append(rooms[name])
+                next_order += 1
+        Room.objects.bulk_create(new_rooms)
+        rooms_created += len(new_rooms)
+        
+        items = []
+        for name, content, item_type, hint in cleaned:
+            room = rooms[name]
+            position = next_position.get(room.pk, 0) + 1
+            next_position[room.pk] = position
+            items.append(MemoryItem(
+                room=room, content=content, item_type=item_type, mnemonic_hint=hint,
+                position_in_room=position,
+            ))
+        MemoryItem.objects.bulk_create(items)
+        items_created += len(items)
+    
+    return rooms_created, items_created
+
+
+def _export_items(palace):
+    """Items of a palace in walk order, fetched with a server-side iterator"""
+    return (
+        MemoryItem.objects.filter(room__palace=palace)
+        .order_by('room__order', 'room__name', 'position_in_room', 'created_at')
+        .values('room_id', 'content', 'item_type', 'mnemonic_hint', 'position_in_room', 'is_mastered')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def export_json(palace):
+    """Yield the palace -> rooms -> items tree as JSON text chunks"""
+    rooms = {
+        room['id']: room
+        for room in palace.rooms.values('id', 'name', 'description', 'order', 'x_coordinate', 'y_coordinate')
+    }
+    header = {
+        'name': palace.name,
+        'description': palace.description,
+        'palace_type': palace.palace_type,
+    }
+    yield json.dumps(header)[:-1] + ', "rooms": ['
+    
+    # Rooms and items share the same ordering, so item groups can be merged
+    # into the room list as they stream past
+    groups = groupby(_export_items(palace), key=lambda item: item.pop('room_id'))
+    group = next(groups, None)
+    for index, (room_id, room) in enumerate(rooms.items()):
+        items = []
+        if group is not None and group[0] == room_id:
+            items = group[1]
+        yield from _room_json(room, items, index == 0)
+        if items:
+            group = next(groups, None)
+    yield ']}'
+
+
+def _room_json(room, items, first):
+    room = {key: value for key, value in room.items() if key != 'id'}
+    yield ('' if first else ', ') + json.dumps(room)[:-1] + ', "items": ['
+    for index, item in enumerate(items):
+        yield ('' if index == 0 else ', ') + json.dumps(item)
+    yield ']}'
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def export_csv(palace):
+    """Yield CSV lines in the same column layout that import_items() reads"""
+    room_names = dict(palace.rooms.values_list('id', 'name'))
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_FIELDS)
+    for item in _export_items(palace):
+        yield writer.writerow([
+            room_names[item['room_id']], item['content'], item['item_type'], item['mnemonic_hint'],
+        ])
+
+
+async def async_chunks(chunks, size=CHUNK_SIZE):
+    """Serve a sync export generator to an ASGI response, one batch of chunks at a time
+    
+    Django would otherwise turn the whole generator into a list before
+    sending the first byte. Batches are read on the request's sync thread,
+    where the export's database cursor lives.
+    """
+    batches = chunked(chunks, size)
+    next_batch = sync_to_async(next, thread_sensitive=True)
+    while (batch := await next_batch(batches, None)) is not None:
+        for chunk in batch:
+            yield chunk
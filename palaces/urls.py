@@ -5,19 +5,32 @@ urlpatterns = [
     # Palace URLs
     path('', views.PalaceListView.as_view(), name='palace_list'),
     path('create/', views.PalaceCreateView.as_view(), name='palace_create'),
+    path('search/', views.search, name='palace_search'),
+    path('gallery/', views.palace_gallery, name='palace_gallery'),
+    path('sync/', views.sync_changes, name='sync_changes'),
+    path('stats/', views.progress_stats, name='progress_stats'),
+    path('cache-stats/', views.cache_stats, name='cache_stats'),
     path('<uuid:pk>/', views.PalaceDetailView.as_view(), name='palace_detail'),
     path('<uuid:pk>/edit/', views.PalaceUpdateView.as_view(), name='palace_edit'),
     path('<uuid:pk>/delete/', views.PalaceDeleteView.as_view(), name='palace_delete'),
+    path('<uuid:palace_pk>/import/', views.palace_import, name='palace_import'),
+    path('<uuid:palace_pk>/export/', views.palace_export, name='palace_export'),
+    path('<uuid:palace_pk>/clone/', views.palace_clone, name='palace_clone'),
+    path('<uuid:palace_pk>/bundle/', views.study_bundle, name='study_bundle'),
+    path('<uuid:palace_pk>/stats/', views.palace_progress_stats, name='palace_progress_stats'),
     
     # Room URLs
     path('<uuid:palace_pk>/rooms/create/', views.room_create, name='room_create'),
+    path('<uuid:palace_pk>/rooms/reorder/', views.reorder_rooms, name='reorder_rooms'),
     path('<uuid:palace_pk>/rooms/<uuid:pk>/', views.RoomDetailView.as_view(), name='room_detail'),
     
     # Memory Item URLs
     path('<uuid:palace_pk>/rooms/<uuid:room_pk>/items/create/', views.memory_item_create, name='memory_item_create'),
+    path('<uuid:palace_pk>/rooms/<uuid:room_pk>/items/reorder/', views.reorder_items, name='reorder_items'),
     path('items/<uuid:item_pk>/toggle-mastery/', views.toggle_mastery, name='toggle_mastery'),
     
     # Study Session URLs
     path('<uuid:palace_pk>/study/', views.start_study_session, name='start_study_session'),
     path('sessions/<uuid:session_pk>/', views.study_session, name='study_session'),
+    path('sessions/<uuid:session_pk>/reviews/', views.submit_reviews, name='submit_reviews'),
 ]
\ No newline at end of file
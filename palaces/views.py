@@ -1,38 +1,82 @@
+import gzip
+import hashlib
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_POST
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
-from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import Count, Max, Q
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
 from django.utils import timezone
-from .models import Palace, Room, MemoryItem, StudySession
-from .forms import PalaceForm, RoomForm, MemoryItemForm
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+from django.conf import settings
+from .models import Palace, Room, MemoryItem, StudySession, UserDailyStats, PalaceDailyStats
+from .forms import PalaceForm, RoomForm, MemoryItemForm, PalaceImportForm
+from . import bundles, cache, cloning, ordering, progress, routing, study, sync, transfer
+from .cache import VersionedPageCacheMixin
+from .decorators import async_login_required, async_require_POST, async_staff_member_required
+from .pagination import InvalidCursor, KeysetPaginator
+from .search import get_backend as get_search_backend
+from .reviews import parse_reviews
 
 
-class PalaceListView(LoginRequiredMixin, ListView):
+class PalaceListView(LoginRequiredMixin, VersionedPageCacheMixin, ListView):
     model = Palace
     template_name = 'palaces/palace_list.html'
     context_object_name = 'palaces'
     paginate_by = 12
+    cache_name = 'palace_list'
+    
+    def get_cache_scopes(self):
+        return [(cache.USER, self.request.user.pk)]
     
     def get_queryset(self):
         return Palace.objects.filter(owner=self.request.user)
 
 
-class PalaceDetailView(LoginRequiredMixin, DetailView):
+# The drag-and-drop and mastery scripts post with the CSRF cookie
+@method_decorator(ensure_csrf_cookie, name='dispatch')
+class PalaceDetailView(LoginRequiredMixin, VersionedPageCacheMixin, DetailView):
     model = Palace
     template_name = 'palaces/palace_detail.html'
     context_object_name = 'palace'
+    cache_name = 'palace_detail'
+    
+    def get_cache_scopes(self):
+        return [(cache.PALACE, self.kwargs['pk'])]
     
     def get_queryset(self):
         return Palace.objects.filter(owner=self.request.user)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['rooms'] = self.object.rooms.all()
-        context['total_items'] = sum(room.memory_items.count() for room in context['rooms'])
-        context['mastered_items'] = sum(room.memory_items.filter(is_mastered=True).count() for room in context['rooms'])
+        # One grouped query: every room carries its own item stats
+        rooms = list(self.object.rooms.annotate(
+            item_count=Count('memory_items'),
+            mastered_count=Count('memory_items', filter=Q(memory_items__is_mastered=True)),
+            last_reviewed=Max('memory_items__last_reviewed'),
+        ))
+        total_items = sum(room.item_count for room in rooms)
+        mastered_items = sum(room.mastered_count for room in rooms)
+        context['rooms'] = rooms
+        context['walk_route'] = routing.rooms_in_route(self.object, rooms)
+        context['route_length'] = self.object.walk_route.get('length')
+        context['total_items'] = total_items
+        context['mastered_items'] = mastered_items
+        context['mastery_percentage'] = (mastered_items / total_items * 100) if total_items else 0
+        context['last_reviewed'] = max((room.last_reviewed for room in rooms if room.last_reviewed), default=None)
         return context
 
 
@@ -73,19 +117,29 @@ class PalaceDeleteView(LoginRequiredMixin, DeleteView):
         return super().delete(request, *args, **kwargs)
 
 
-class RoomDetailView(LoginRequiredMixin, DetailView):
+@method_decorator(ensure_csrf_cookie, name='dispatch')
+class RoomDetailView(LoginRequiredMixin, VersionedPageCacheMixin, DetailView):
     model = Room
     template_name = 'palaces/room_detail.html'
     context_object_name = 'room'
+    cache_name = 'room_detail'
+    
+    def get_cache_scopes(self):
+        return [(cache.PALACE, self.kwargs['palace_pk'])]
     
     def get_object(self):
-        palace = get_object_or_404(Palace, pk=self.kwargs['palace_pk'], owner=self.request.user)
-        return get_object_or_404(Room, pk=self.kwargs['pk'], palace=palace)
+        return get_object_or_404(
+            Room.objects.select_related('palace'),
+            pk=self.kwargs['pk'], palace__pk=self.kwargs['palace_pk'], palace__owner=self.request.user,
+        )
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['palace'] = self.object.palace
         context['memory_items'] = self.object.memory_items.all()
+        nearby_ids = routing.nearby_room_ids(self.object.palace, self.object)
+        nearby = Room.objects.in_bulk(nearby_ids) if nearby_ids else {}
+        context['nearby_rooms'] = [nearby[pk] for pk in map(uuid.UUID, nearby_ids) if pk in nearby]
         return context
 
 
@@ -135,61 +189,365 @@ def memory_item_create(request, palace_pk, room_pk):
     })
 
 
+GALLERY_SORTS = {
+    'newest': ['created_at', 'id'],
+    'popular': ['study_count', 'id'],
+}
+PALACE_TYPES = {key for key, _ in Palace.PALACE_TYPES}
+
+
+def _render_gallery(request, palace_type, sort, cursor):
+    palaces = Palace.objects.filter(is_public=True).select_related('owner')
+    if palace_type:
+        palaces = palaces.filter(palace_type=palace_type)
+    paginator = KeysetPaginator(palaces, GALLERY_SORTS[sort], per_page=12)
+    try:
+        page = paginator.page(cursor)
+    except InvalidCursor:
+        page = paginator.page()
+    
+    return render(request, 'palaces/gallery.html', {
+        'palaces': page,
+        'next_cursor': page.next_cursor,
+        'palace_type': palace_type,
+        'sort': sort,
+        'palace_types': Palace.PALACE_TYPES,
+    })
+
+
+def palace_gallery(request):
+    """Browse public palaces; anonymous pages are cached and served with an ETag"""
+    palace_type = request.GET.get('type', '')
+    palace_type = palace_type if palace_type in PALACE_TYPES else ''
+    sort = request.GET.get('sort', 'newest')
+    sort = sort if sort in GALLERY_SORTS else 'newest'
+    cursor = request.GET.get('cursor', '')[:200]
+    
+    if request.user.is_authenticated or len(messages.get_messages(request)):
+        response = _render_gallery(request, palace_type, sort, cursor)
+        patch_cache_control(response, private=True)
+        return response
+    
+    def render_entry():
+        content = _render_gallery(request, palace_type, sort, cursor).content
+        return {'content': content, 'etag': hashlib.md5(content).hexdigest()}
+    
+    entry = cache.cached_call(
+        'gallery', f'{palace_type}:{sort}:{cursor}', render_entry, timeout=settings.GALLERY_CACHE_TIMEOUT
+    )
+    response = HttpResponse(entry['content'])
+    response['ETag'] = quote_etag(entry['etag'])
+    patch_cache_control(response, public=True, max_age=settings.GALLERY_CACHE_TIMEOUT)
+    patch_vary_headers(response, ['Cookie'])
+    return get_conditional_response(request, etag=response['ETag'], response=response)
+
+
+@login_required
+def palace_import(request, palace_pk):
+    palace = get_object_or_404(Palace, pk=palace_pk, owner=request.user)
+    
+    if request.method == 'POST':
+        form = PalaceImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                rooms_created, items_created = transfer.import_items(
+                    palace, form.cleaned_data['file'], form.cleaned_data['format'],
+                    default_room=form.cleaned_data['default_room'],
+                )
+            except ValidationError as e:
+                form.add_error('file', e)
+            else:
+                messages.success(request, f'Imported {items_created} items into {rooms_created} new rooms!')
+                return redirect('palace_detail', pk=palace.pk)
+    else:
+        form = PalaceImportForm()
+    
+    return render(request, 'palaces/palace_import.html', {
+        'form': form,
+        'palace': palace,
+        'title': 'Import Memory Items'
+    })
+
+
+@login_required
+def palace_export(request, palace_pk):
+    """Stream the whole palace as JSON (default) or CSV"""
+    palace = get_object_or_404(Palace, pk=palace_pk, owner=request.user)
+    
+    if request.GET.get('format') == 'csv':
+        chunks, content_type, extension = transfer.export_csv(palace), 'text/csv', 'csv'
+    else:
+        chunks, content_type, extension = transfer.export_json(palace), 'application/json', 'json'
+    if isinstance(request, ASGIRequest):
+        # ASGI servers need an async iterator to stream without buffering
+        chunks = transfer.async_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="palace-{palace.pk}.{extension}"'
+    return response
+
+
+@login_required
+@require_POST
+def palace_clone(request, palace_pk):
+    """Fork one of the user's own palaces or any public palace"""
+    source = get_object_or_404(Palace.objects.filter(Q(owner=request.user) | Q(is_public=True)), pk=palace_pk)
+    palace = cloning.clone_palace(source, request.user, include_items=request.POST.get('include_items', '1') == '1')
+    messages.success(request, f'Palace "{palace.name}" created from "{source.name}"!')
+    return redirect('palace_detail', pk=palace.pk)
+
+
+@login_required
+def study_bundle(request, palace_pk):
+    """A palace's rooms and items for offline study, as JSON or ``?format=msgpack``
+
+    The ETag comes from the palace's content version, so an unchanged palace
+    answers ``If-None-Match`` with a 304 without reading rooms or items.
+    """
+    palace = get_object_or_404(Palace.objects.filter(Q(owner=request.user) | Q(is_public=True)), pk=palace_pk)
+    fmt = request.GET.get('format', 'json')
+    if fmt not in bundles.available_formats():
+        return JsonResponse({'success': False, 'error': f'Unsupported format: {fmt}'}, status=406)
+    
+    gzipped = 'gzip' in request.headers.get('Accept-Encoding', '')
+    version, = cache.get_versions((cache.PALACE, palace.pk))
+    response = HttpResponse(content_type=bundles.CONTENT_TYPES[fmt])
+    response['ETag'] = quote_etag(f'{palace.pk.hex}-{version}-{fmt}' + ('-gzip' if gzipped else ''))
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Accept-Encoding', 'Cookie'])
+    conditional = get_conditional_response(request, etag=response['ETag'], response=response)
+    if conditional is not response:
+        return conditional
+    
+    content = bundles.get_bundle(palace, version, fmt)
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    else:
+        content = gzip.decompress(content)
+    response.content = content
+    return response
+
+
+@login_required
+def search(request):
+    """Full-text search across the user's memory items"""
+    query = request.GET.get('q', '').strip()
+    results = get_search_backend().search(request.user, query) if query else []
+    
+    return render(request, 'palaces/search.html', {
+        'search_query': query,
+        'results': results,
+    })
+
+
 @login_required
 def start_study_session(request, palace_pk):
     palace = get_object_or_404(Palace, pk=palace_pk, owner=request.user)
     
-    # Create new study session
-    session = StudySession.objects.create(
-        user=request.user,
-        palace=palace
-    )
+    # Held in the cache until it completes; see palaces.study
+    session_pk = study.start(request.user, palace)
     
-    return redirect('study_session', session_pk=session.pk)
+    return redirect('study_session', session_pk=session_pk)
 
 
 @login_required
 def study_session(request, session_pk):
-    session = get_object_or_404(StudySession, pk=session_pk, user=request.user)
-    
-    if request.method == 'POST':
-        # Handle study session completion
-        session.completed_at = timezone.now()
-        session.items_reviewed = int(request.POST.get('items_reviewed', 0))
-        session.items_mastered = int(request.POST.get('items_mastered', 0))
-        if session.items_reviewed > 0:
-            session.accuracy_score = (session.items_mastered / session.items_reviewed) * 100
-        session.save()
-        
-        messages.success(request, f'Study session completed! Accuracy: {session.accuracy_score:.1f}%')
-        return redirect('palace_detail', pk=session.palace.pk)
+    state = study.load(session_pk, request.user)
+    if state is None:
+        # Already written to the database
+        session = get_object_or_404(StudySession.objects.select_related('palace'), pk=session_pk, user=request.user)
+        if request.method == 'POST':
+            return redirect('palace_detail', pk=session.palace_id)
+    else:
+        session = study.as_session(state)
+        session.palace = get_object_or_404(Palace, pk=state['palace'], owner=request.user)
+        if request.method == 'POST':
+            # Handle study session completion: write the answers in one transaction
+            try:
+                saved = study.finish(session_pk, request.user)
+            except study.SessionBusy:
+                messages.error(request, 'Your last answers are still being saved, please try again.')
+                return redirect('study_session', session_pk=session_pk)
+            if saved is None:
+                messages.info(request, 'Study session ended without any answers.')
+            else:
+                messages.success(request, f'Study session completed! Accuracy: {saved.accuracy_score:.1f}%')
+            return redirect('palace_detail', pk=session.palace_id)
     
-    # Get all memory items for this palace
-    rooms = session.palace.rooms.all()
-    memory_items = []
-    for room in rooms:
-        memory_items.extend(room.memory_items.all())
+    # The most overdue items, presented in walk-route order. Reviews bump
+    # the palace version; the short timeout lets newly due items in.
+    limit = settings.STUDY_SESSION_SIZE
+    palace = session.palace
+    route = {pk: i for i, pk in enumerate(palace.walk_route.get('rooms', []))}
+    version, = cache.get_versions((cache.PALACE, session.palace_id))
+    memory_items = cache.cached_call(
+        'study_queue', f'{session.palace_id}:{version}:{limit}',
+        lambda: sorted(
+            MemoryItem.objects.due(palace).select_related('room')[:limit],
+            key=lambda item: (route.get(str(item.room_id), len(route)), item.position_in_room),
+        ),
+        timeout=60,
+    )
     
     return render(request, 'palaces/study_session.html', {
         'session': session,
-        'palace': session.palace,
-        'rooms': rooms,
+        'palace': palace,
+        'rooms': routing.rooms_in_route(palace, palace.rooms.all()),
         'memory_items': memory_items,
+        'cursor': state['cursor'] if state else 0,
     })
 
 
+def _apply_order(request, reorder, parent):
+    try:
+        reorder(parent, ordering.parse_order(json.loads(request.body or b'{}')))
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': e.messages[0]}, status=400)
+    return JsonResponse({'success': True})
+
+
 @login_required
-def toggle_mastery(request, item_pk):
+@require_POST
+def reorder_rooms(request, palace_pk):
+    """AJAX view taking the palace's complete room order as ``{"order": [<room uuid>, ...]}``"""
+    palace = get_object_or_404(Palace, pk=palace_pk, owner=request.user)
+    return _apply_order(request, ordering.reorder_rooms, palace)
+
+
+@login_required
+@require_POST
+def reorder_items(request, palace_pk, room_pk):
+    """AJAX view taking the room's complete item order as ``{"order": [<item uuid>, ...]}``"""
+    room = get_object_or_404(Room, pk=room_pk, palace__pk=palace_pk, palace__owner=request.user)
+    return _apply_order(request, ordering.reorder_items, room)
+
+
+@async_login_required
+async def toggle_mastery(request, item_pk):
     """AJAX view to toggle memory item mastery status"""
     if request.method == 'POST':
-        memory_item = get_object_or_404(MemoryItem, pk=item_pk, room__palace__owner=request.user)
+        try:
+            memory_item = await MemoryItem.objects.aget(pk=item_pk, room__palace__owner=request.user)
+        except MemoryItem.DoesNotExist:
+            raise Http404('No memory item found')
+        # The user's own call, not a recall: no ReviewEvent, and the SM-2
+        # schedule is left for the next study review
         memory_item.is_mastered = not memory_item.is_mastered
-        memory_item.last_reviewed = timezone.now()
-        memory_item.save()
+        await memory_item.asave(update_fields=['is_mastered', 'updated_at'])
         
         return JsonResponse({
             'success': True,
             'is_mastered': memory_item.is_mastered
         })
     
-    return JsonResponse({'success': False})
\ No newline at end of file
+    return JsonResponse({'success': False})
+
+
+@async_login_required
+@async_require_POST
+async def submit_reviews(request, session_pk):
+    """AJAX view to record study answers in the session's cached state
+
+    Expects a JSON body like ``{"reviews": [{"item": <uuid>, "grade": 0-5,
+    "response_time_ms": 1200}, ...], "cursor": 3, "complete": false}``.
+    Answers reach the database when the session completes, in one
+    transaction (see palaces.study).
+    """
+    try:
+        payload = json.loads(request.body or b'{}')
+        reviews = parse_reviews(payload)
+        cursor = payload.get('cursor')
+        cursor = None if cursor is None else max(0, int(cursor))
+        result = await sync_to_async(study.add_reviews)(session_pk, request.user, reviews, cursor)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'error': 'Invalid cursor'}, status=400)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': e.messages[0]}, status=400)
+    except study.SessionBusy:
+        return JsonResponse({'success': False, 'error': 'Session is busy'}, status=409)
+    if result is None:
+        if await StudySession.objects.filter(pk=session_pk, user=request.user).aexists():
+            return JsonResponse({'success': False, 'error': 'Session already completed'}, status=400)
+        raise Http404('No study session found')
+    
+    state, items = result
+    session = study.as_session(state)
+    if payload.get('complete'):
+        saved = await sync_to_async(study.finish)(session_pk, request.user)
+        session.completed_at = saved.completed_at if saved else timezone.now()
+    
+    return JsonResponse({
+        'success': True,
+        'items_reviewed': session.items_reviewed,
+        'items_mastered': session.items_mastered,
+        'accuracy_score': session.accuracy_score,
+        'completed': session.completed_at is not None,
+        'items': [
+            {'id': str(item.pk), 'is_mastered': item.is_mastered, 'next_due': item.next_due.isoformat()}
+            for item in items
+        ],
+    })
+
+
+def _history_days(request):
+    try:
+        return max(1, min(int(request.GET.get('days', progress.HISTORY_DAYS)), progress.MAX_HISTORY_DAYS))
+    except ValueError:
+        return progress.HISTORY_DAYS
+
+
+@async_login_required
+async def progress_stats(request):
+    """AJAX view with the user's daily study history (``?days=``, default a year) and streaks"""
+    queryset = progress.history(UserDailyStats.objects.filter(user=request.user), _history_days(request))
+    rows = [row async for row in queryset]
+    return JsonResponse({'success': True, **progress.summary(rows)})
+
+
+@async_login_required
+async def palace_progress_stats(request, palace_pk):
+    """AJAX view with a palace's daily study history"""
+    if not await Palace.objects.filter(pk=palace_pk, owner=request.user).aexists():
+        raise Http404('No palace found')
+    queryset = progress.history(PalaceDailyStats.objects.filter(palace_id=palace_pk), _history_days(request))
+    rows = [row async for row in queryset]
+    return JsonResponse({'success': True, **progress.summary(rows)})
+
+
+@login_required
+def sync_changes(request):
+    """Delta sync: GET pulls a page of changes since ``?cursor=``, POST pushes offline edits
+
+    POST expects ``{"changes": [{"type": "palace|room|item", "op": "upsert|delete",
+    "id": <uuid>, "base_updated_at": <iso time or null>, "fields": {...}}, ...]}``.
+    """
+    if request.method == 'POST':
+        try:
+            changes = sync.parse_changes(json.loads(request.body or b'{}'))
+            results = sync.push(request.user, changes)
+        except json.JSONDecodeError:
+            return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+        except ValidationError as e:
+            return JsonResponse({'success': False, 'error': e.messages[0]}, status=400)
+        except IntegrityError:
+            return JsonResponse({'success': False, 'error': 'A room order or item position is taken'}, status=409)
+        return JsonResponse({'success': True, 'results': results})
+    
+    try:
+        limit = max(1, min(int(request.GET.get('limit', sync.DEFAULT_PAGE_SIZE)), sync.MAX_PAGE_SIZE))
+    except ValueError:
+        limit = sync.DEFAULT_PAGE_SIZE
+    try:
+        page = sync.pull(request.user, request.GET.get('cursor', '')[:500], limit)
+    except InvalidCursor:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor'}, status=400)
+    return JsonResponse({'success': True, **page})
+
+
+@async_staff_member_required
+async def cache_stats(request):
+    """Hit/miss counters of the palace page caches in this worker process"""
+    return JsonResponse(dict(cache.stats))